@@ -1,7 +1,9 @@
-import traceback, json
+import traceback, json, hashlib
 import boto3
 import cfnresponse
 
+SETTINGS_VARIABLE = 'cacheSettings'
+
 
 def handler(event, context):
     status = cfnresponse.SUCCESS
@@ -13,8 +15,18 @@ def handler(event, context):
         stage_name = event['ResourceProperties']['StageName']
 
         if event['RequestType'] in ['Create', 'Update']:
-            deployment = create_deployment(rest_api_id, stage_name)
-            pid = deployment
+            fingerprint = definition_fingerprint(event['ResourceProperties'])
+            deployment = current_deployment(rest_api_id, stage_name)
+
+            # an unchanged definition keeps the stage (and its cache) on the deployment it already has
+            if deployment is None or deployment.get('description') != fingerprint:
+                deployment = create_deployment(rest_api_id, stage_name, fingerprint)
+
+            pid = deployment['id']
+            response['DeploymentId'] = deployment['id']
+
+            # cache settings live on the stage, they don't need a new deployment
+            update_stage(rest_api_id, stage_name, event['ResourceProperties'])
 
         if event['RequestType'] == 'Delete':
             # Do nothing, APIGW deployments will be deleted when the APIGW is deleted
@@ -31,12 +43,62 @@ def handler(event, context):
         cfnresponse.send(event, context, status, response, pid)
 
 
-def create_deployment(rest_api_id, stage_name):
+def definition_fingerprint(properties):
+    # LambdaUris order doesn't change what's deployed, only their values do
+    digest = hashlib.sha256(properties.get('DefinitionHash', '').encode('utf-8'))
+    digest.update(json.dumps(sorted(properties['LambdaUris'])).encode('utf-8'))
+
+    return f'fingerprint:{digest.hexdigest()}'
+
+
+def current_deployment(rest_api_id, stage_name):
+    client = boto3.client('apigateway')
+
+    try:
+        stage = client.get_stage(restApiId=rest_api_id, stageName=stage_name)
+        return client.get_deployment(restApiId=rest_api_id, deploymentId=stage['deploymentId'])
+    except client.exceptions.NotFoundException:
+        return None
+
+
+def stage_patch(stage, properties):
+    settings = {setting['Path']: setting['Value'] for setting in properties.get('StageSettings', [])}
+
+    # the applied settings are fingerprinted in a stage variable, they're only patched when they change
+    fingerprint = hashlib.sha1(json.dumps(settings, sort_keys=True).encode('utf-8')).hexdigest()
+    if stage.get('variables', {}).get(SETTINGS_VARIABLE) == fingerprint:
+        return []
+
+    current = {'/cacheClusterEnabled': stage.get('cacheClusterEnabled', False), '/cacheClusterSize': stage.get('cacheClusterSize')}
+
+    return [
+        {'op': 'replace', 'path': path, 'value': str(value)} for path, value in sorted(settings.items())
+        if str(current.get(path)).lower() != str(value).lower()
+    ] + [{'op': 'replace', 'path': f'/variables/{SETTINGS_VARIABLE}', 'value': fingerprint}]
+
+
+def update_stage(rest_api_id, stage_name, properties):
+    client = boto3.client('apigateway')
+
+    stage = client.get_stage(restApiId=rest_api_id, stageName=stage_name)
+    operations = stage_patch(stage, properties)
+
+    # an unchanged cache cluster isn't patched, resizing or re-enabling it flushes the cache
+    if operations:
+        client.update_stage(
+            restApiId=rest_api_id,
+            stageName=stage_name,
+            patchOperations=operations
+        )
+
+
+def create_deployment(rest_api_id, stage_name, fingerprint):
     client = boto3.client('apigateway')
 
     response = client.create_deployment(
         restApiId=rest_api_id,
-        stageName=stage_name
+        stageName=stage_name,
+        description=fingerprint
     )
 
-    return response['id']
+    return response
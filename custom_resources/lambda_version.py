@@ -1,7 +1,20 @@
-import traceback, json
+import traceback, json, hashlib
+from concurrent.futures import ThreadPoolExecutor
 import boto3
+import botocore.config
 import cfnresponse
 
+PUBLISH_WORKERS = 8
+
+# published versions snapshot these along with the layers
+VERSIONED = ['CodeSha256', 'Runtime', 'Handler', 'MemorySize', 'Timeout', 'Environment', 'Architectures']
+
+# one client for every function in the batch, boto3 clients are thread-safe
+client = boto3.client('lambda', config=botocore.config.Config(
+    max_pool_connections=PUBLISH_WORKERS,
+    retries={'max_attempts': 10},
+))
+
 
 def handler(event, context):
     status = cfnresponse.SUCCESS
@@ -9,16 +22,21 @@ def handler(event, context):
     pid = None
 
     try:
-        function_name = event['ResourceProperties']['FunctionName']
-
         if event['RequestType'] in ['Create', 'Update']:
-            version = create_version(function_name)
-            pid = f'{function_name}:{version}'
-            response['Version'] = version
+            functions = event['ResourceProperties']['Functions']
+
+            with ThreadPoolExecutor(max_workers=min(PUBLISH_WORKERS, len(functions))) as executor:
+                versions = executor.map(lambda f: create_version(f['FunctionName']), functions)
+                response = dict(zip([f.get('Name', f['FunctionName']) for f in functions], versions))
+
+            # the response's attributes are what templates GetAtt, one per function (logical) name
+            pid = 'LambdaVersions-{}'.format(
+                hashlib.sha1(json.dumps(response, sort_keys=True).encode('utf-8')).hexdigest()
+            )
 
         if event['RequestType'] == 'Delete':
             # Do nothing, Lambda versions will be deleted when the Lambda function is deleted
-            pass
+            pid = event.get('PhysicalResourceId')
 
     except Exception as err:
         print(json.dumps({
@@ -31,11 +49,35 @@ def handler(event, context):
         cfnresponse.send(event, context, status, response, pid)
 
 
+def latest_version(function_name):
+    latest = None
+
+    for page in client.get_paginator('list_versions_by_function').paginate(FunctionName=function_name):
+        for version in page['Versions']:
+            if version['Version'] != '$LATEST':
+                latest = version
+
+    return latest
+
+
+def snapshot(configuration):
+    return [configuration.get(key) for key in VERSIONED] + sorted(layer['Arn'] for layer in configuration.get('Layers', []))
+
+
 def create_version(function_name):
-    client = boto3.client('lambda')
+    current = client.get_function_configuration(FunctionName=function_name)
+    latest = latest_version(function_name)
+
+    # idle deploys re-send the whole batch, unchanged functions keep their published version
+    if latest and snapshot(latest) == snapshot(current):
+        print(json.dumps({'function': function_name, 'version': latest['Version'], 'published': False}))
+        return latest['Version']
 
+    # CodeSha256 makes Lambda refuse to publish if the code changed since it was read
     response = client.publish_version(
-        FunctionName=function_name
+        FunctionName=function_name,
+        CodeSha256=current['CodeSha256'],
     )
 
+    print(json.dumps({'function': function_name, 'version': response['Version'], 'published': True}))
     return response['Version']
@@ -0,0 +1,465 @@
+import os
+import re
+import sys
+import json
+import time
+import uuid
+import base64
+import asyncio
+import logging
+import argparse
+import importlib
+import traceback
+import multiprocessing
+from http import HTTPStatus
+from urllib.parse import urlsplit, parse_qsl
+from concurrent.futures import ThreadPoolExecutor
+
+import yaml
+
+
+script_path = os.path.dirname(os.path.realpath(__file__))
+project_path = os.path.dirname(script_path)
+
+SWAGGER_PATH = os.path.join(project_path, 'src', 'swagger.cloudformation.yaml')
+SOURCE_PATH = os.path.join(project_path, 'src')
+LAMBDA_URI_SUFFIX = 'LambdaURI'
+METHODS = ['get', 'put', 'post', 'delete', 'options', 'head', 'patch']
+ANY_METHOD = 'x-amazon-apigateway-any-method'
+
+logger = logging.getLogger('apigw_emulator')
+
+
+class SwaggerLoader(yaml.SafeLoader):
+    pass
+
+
+# CloudFormation intrinsics only matter for the integration uri, keep them as (function, argument)
+SwaggerLoader.add_constructor('!Ref', lambda loader, node: ('Ref', loader.construct_scalar(node)))
+SwaggerLoader.add_constructor('!GetAtt', lambda loader, node: ('GetAtt', loader.construct_scalar(node)))
+
+
+class Route:
+    def __init__(self, resource, method, function):
+        self.resource = resource
+        self.method = method
+        self.function = function
+
+        # {name} matches one path segment, {name+} the rest of the path, like API Gateway
+        pattern = re.sub(r'\\\{(\w+)\\\+\\\}', r'(?P<\1>.+)', re.escape(resource))
+        pattern = re.sub(r'\\\{(\w+)\\\}', r'(?P<\1>[^/]+)', pattern)
+        self.regex = re.compile('^{}$'.format(pattern))
+
+    def match(self, method, path):
+        if self.method not in ('ANY', method):
+            return None
+
+        match = self.regex.match(path)
+        return match.groupdict() if match else None
+
+
+def load_routes(swagger_path):
+    with open(swagger_path) as f:
+        swagger = yaml.load(f, Loader=SwaggerLoader)
+
+    routes = []
+
+    for resource, operations in swagger.get('paths', {}).items():
+        for method, operation in operations.items():
+            if method not in METHODS + [ANY_METHOD]:
+                continue
+
+            integration = operation.get('x-amazon-apigateway-integration', {})
+            uri = integration.get('uri')
+
+            if integration.get('type') != 'aws_proxy' or not isinstance(uri, tuple) or uri[0] != 'Ref' \
+                    or not uri[1].endswith(LAMBDA_URI_SUFFIX):
+                logger.warning('Skipping %s %s: only aws_proxy integrations with !Ref <Name>%s are emulated',
+                               method.upper(), resource, LAMBDA_URI_SUFFIX)
+                continue
+
+            routes.append(Route(
+                resource, 'ANY' if method == ANY_METHOD else method.upper(), uri[1][:-len(LAMBDA_URI_SUFFIX)]
+            ))
+
+    # literal segments win over path parameters, like API Gateway's most specific match
+    return sorted(routes, key=lambda route: (route.resource.count('{'), -len(route.resource)))
+
+
+def import_paths(fn_root_dir):
+    # dist/ is what gets deployed, fall back to code/ plus the shared runtime when it isn't built
+    dist_dir = os.path.join(fn_root_dir, 'dist')
+    if os.path.isdir(dist_dir):
+        paths = [dist_dir]
+    else:
+        paths = [os.path.join(fn_root_dir, 'code'), os.path.join(SOURCE_PATH, 'shared')]
+
+    return paths + [os.path.join(fn_root_dir, 'layer', 'python')]
+
+
+class Context:
+    def __init__(self, function_name, request_id, timeout, memory):
+        self.function_name = function_name
+        self.function_version = '$LATEST'
+        self.invoked_function_arn = 'arn:aws:lambda:local:000000000000:function:{}'.format(function_name)
+        self.memory_limit_in_mb = memory
+        self.aws_request_id = request_id
+        self.log_group_name = '/aws/lambda/{}'.format(function_name)
+        self.log_stream_name = 'local'
+        self.deadline = time.time() + timeout
+
+    def get_remaining_time_in_millis(self):
+        return max(0, int((self.deadline - time.time()) * 1000))
+
+
+def container_main(conn, paths, handler, function_name, timeout, memory):
+    sys.path[:0] = paths
+    os.environ.update(AWS_LAMBDA_FUNCTION_NAME=function_name, AWS_LAMBDA_FUNCTION_MEMORY_SIZE=str(memory))
+    module_name, handler_name = handler.rsplit('.', 1)
+    function = None
+
+    while True:
+        message = conn.recv()
+        if message is None:
+            break
+
+        event, request_id = message
+        cold = function is None
+        start = time.perf_counter()
+        init = 0.0
+
+        try:
+            if cold:
+                function = getattr(importlib.import_module(module_name), handler_name)
+                init = time.perf_counter() - start
+
+            result = function(event, Context(function_name, request_id, timeout, memory))
+            conn.send(('ok', result, cold, init, time.perf_counter() - start))
+        except Exception:
+            conn.send(('error', traceback.format_exc(), cold, init, time.perf_counter() - start))
+
+
+# One worker process per concurrent execution environment: the first invocation imports the
+# handler (cold start), later ones reuse the module state (warm)
+class Container:
+    def __init__(self, context, paths, handler, function_name, timeout, memory):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(
+            target=container_main, args=(child_conn, paths, handler, function_name, timeout, memory), daemon=True
+        )
+        self.process.start()
+        self.timeout = timeout
+        self.invocations = 0
+        self.last_used = time.monotonic()
+
+    def invoke(self, event, request_id):
+        self.conn.send((event, request_id))
+        self.invocations += 1
+
+        if not self.conn.poll(self.timeout):
+            self.close(kill=True)
+            raise TimeoutError('Task timed out after {:.2f} seconds'.format(self.timeout))
+
+        result = self.conn.recv()
+        self.last_used = time.monotonic()
+        return result
+
+    def close(self, kill=False):
+        if kill:
+            self.process.terminate()
+        else:
+            try:
+                self.conn.send(None)
+            except (OSError, BrokenPipeError):
+                pass
+
+        self.process.join(1)
+
+
+class FunctionPool:
+    def __init__(self, name, args, context):
+        self.name = name
+        self.args = args
+        self.context = context
+        self.paths = import_paths(os.path.join(SOURCE_PATH, name.lower()))
+        self.idle = []
+        # created on first use, so it belongs to the loop serving the requests
+        self.semaphore = None
+        self.executor = ThreadPoolExecutor(max_workers=args.concurrency)
+
+    def start(self):
+        return Container(self.context, self.paths, self.args.handler, self.name, self.args.timeout, self.args.memory)
+
+    # starting and stopping processes blocks, it happens on the executor so other requests keep being served
+    async def acquire(self, loop):
+        # execution environments idle for longer than the timeout are reclaimed, the next call is cold
+        now = time.monotonic()
+
+        while self.idle:
+            container = self.idle.pop()
+            if now - container.last_used <= self.args.idle_timeout:
+                return container
+            loop.run_in_executor(self.executor, container.close)
+
+        return await loop.run_in_executor(self.executor, self.start)
+
+    def release(self, loop, container):
+        if self.args.max_invocations and container.invocations >= self.args.max_invocations:
+            loop.run_in_executor(self.executor, container.close)
+        else:
+            self.idle.append(container)
+
+    async def invoke(self, event, request_id):
+        loop = asyncio.get_event_loop()
+
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.args.concurrency)
+
+        async with self.semaphore:
+            container = await self.acquire(loop)
+
+            try:
+                result = await loop.run_in_executor(self.executor, container.invoke, event, request_id)
+            except Exception:
+                loop.run_in_executor(self.executor, container.close, True)
+                raise
+
+            self.release(loop, container)
+            return result
+
+    def close(self):
+        for container in self.idle:
+            container.close()
+
+        self.executor.shutdown(wait=False)
+
+
+def proxy_event(route, method, target, headers, body, path_parameters, stage, source_ip):
+    url = urlsplit(target)
+    query = parse_qsl(url.query, keep_blank_values=True)
+
+    multi_query = {}
+    for name, value in query:
+        multi_query.setdefault(name, []).append(value)
+
+    multi_headers = {}
+    for name, value in headers:
+        multi_headers.setdefault(name, []).append(value)
+
+    try:
+        text, is_base64 = body.decode('utf-8'), False
+    except UnicodeDecodeError:
+        text, is_base64 = base64.b64encode(body).decode('ascii'), True
+
+    now = time.time()
+
+    return {
+        'resource': route.resource,
+        'path': url.path,
+        'httpMethod': method,
+        'headers': {name: values[-1] for name, values in multi_headers.items()} or None,
+        'multiValueHeaders': multi_headers or None,
+        'queryStringParameters': {name: values[-1] for name, values in multi_query.items()} or None,
+        'multiValueQueryStringParameters': multi_query or None,
+        'pathParameters': path_parameters or None,
+        'stageVariables': None,
+        'requestContext': {
+            'resourcePath': route.resource,
+            'httpMethod': method,
+            'path': '/{}{}'.format(stage, url.path) if stage else url.path,
+            'stage': stage or 'local',
+            'requestId': str(uuid.uuid4()),
+            'requestTimeEpoch': int(now * 1000),
+            'protocol': 'HTTP/1.1',
+            'identity': {'sourceIp': source_ip, 'userAgent': dict(headers).get('User-Agent')},
+            'accountId': '000000000000',
+            'apiId': 'local',
+        },
+        'body': text if body else None,
+        'isBase64Encoded': is_base64 if body else False,
+    }
+
+
+class Emulator:
+    def __init__(self, routes, args):
+        self.routes = routes
+        self.args = args
+        context = multiprocessing.get_context('spawn')
+        self.pools = {name: FunctionPool(name, args, context) for name in sorted({r.function for r in routes})}
+
+    def route(self, method, path):
+        for route in self.routes:
+            path_parameters = route.match(method, path)
+            if path_parameters is not None:
+                return route, path_parameters
+
+        return None, None
+
+    async def handle(self, method, target, headers, body, source_ip):
+        path = urlsplit(target).path
+
+        if self.args.stage:
+            prefix = '/{}'.format(self.args.stage)
+            if not (path == prefix or path.startswith(prefix + '/')):
+                return 403, {}, {'message': 'Forbidden'}, {}
+            path, target = path[len(prefix):] or '/', target[len(prefix):] or '/'
+
+        route, path_parameters = self.route(method, path)
+
+        if route is None:
+            return 403, {}, {'message': 'Missing Authentication Token'}, {}
+
+        event = proxy_event(route, method, target, headers, body, path_parameters, self.args.stage,
+                            source_ip)
+        request_id = event['requestContext']['requestId']
+
+        try:
+            status, result, cold, init, duration = await self.pools[route.function].invoke(event, request_id)
+        except (TimeoutError, EOFError, OSError) as e:
+            logger.error('%s %s', route.function, repr(e))
+            return 502, {}, {'message': 'Internal server error'}, {}
+
+        stats = {
+            'X-Amzn-RequestId': request_id,
+            'X-Emulator-Cold-Start': str(cold).lower(),
+            'X-Emulator-Init-Ms': '{:.3f}'.format(init * 1000),
+            'X-Emulator-Duration-Ms': '{:.3f}'.format(duration * 1000),
+        }
+
+        if status != 'ok' or not isinstance(result, dict) or 'statusCode' not in result:
+            logger.error('%s returned a malformed proxy response or failed:\n%s', route.function, result)
+            return 502, {}, {'message': 'Internal server error'}, stats
+
+        response_headers = dict(result.get('headers') or {})
+        for name, values in (result.get('multiValueHeaders') or {}).items():
+            response_headers[name] = ', '.join(str(value) for value in values)
+
+        body = result.get('body') or ''
+        body = base64.b64decode(body) if result.get('isBase64Encoded') else str(body).encode('utf-8')
+
+        return int(result['statusCode']), response_headers, body, stats
+
+    async def serve_connection(self, reader, writer):
+        source_ip = (writer.get_extra_info('peername') or ('127.0.0.1',))[0]
+
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+
+                method, target, version = request_line.decode('latin-1').split()
+
+                headers = []
+                while True:
+                    line = (await reader.readline()).decode('latin-1').rstrip('\r\n')
+                    if not line:
+                        break
+                    name, _, value = line.partition(':')
+                    headers.append((name.strip(), value.strip()))
+
+                lowered = {name.lower(): value for name, value in headers}
+                body = await reader.readexactly(int(lowered.get('content-length', 0) or 0))
+
+                start = time.perf_counter()
+                status, response_headers, response_body, stats = await self.handle(
+                    method, target, headers, body, source_ip
+                )
+
+                if isinstance(response_body, dict):
+                    response_headers = dict(response_headers, **{'Content-Type': 'application/json'})
+                    response_body = json.dumps(response_body).encode('utf-8')
+
+                keep_alive = version == 'HTTP/1.1' and lowered.get('connection', '').lower() != 'close'
+                response_headers = dict(response_headers, **stats)
+                response_headers['Content-Length'] = str(len(response_body))
+                response_headers['Connection'] = 'keep-alive' if keep_alive else 'close'
+
+                try:
+                    reason = HTTPStatus(status).phrase
+                except ValueError:
+                    reason = ''
+
+                writer.write('HTTP/1.1 {} {}\r\n'.format(status, reason).encode('latin-1'))
+                writer.write(''.join('{}: {}\r\n'.format(k, v) for k, v in response_headers.items()).encode('latin-1'))
+                writer.write(b'\r\n' + response_body)
+                await writer.drain()
+
+                logger.info('%s %s %s %d %.1fms%s', source_ip, method, target, status,
+                            (time.perf_counter() - start) * 1000,
+                            ' (cold)' if stats.get('X-Emulator-Cold-Start') == 'true' else '')
+
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    def close(self):
+        for pool in self.pools.values():
+            pool.close()
+
+
+async def serve(emulator, args):
+    server = await asyncio.start_server(emulator.serve_connection, args.host, args.port, backlog=args.backlog)
+
+    for route in emulator.routes:
+        logger.info('%s %s -> %s (%s)', route.method, route.resource, route.function,
+                    os.pathsep.join(emulator.pools[route.function].paths))
+    logger.info('Listening on http://%s:%d/%s', args.host, args.port, args.stage)
+
+    # until interrupted, Server.serve_forever is 3.7+
+    try:
+        await asyncio.get_event_loop().create_future()
+    finally:
+        server.close()
+        await server.wait_closed()
+
+
+parser = argparse.ArgumentParser(description="Serve the swagger aws_proxy routes with the local lambda handlers")
+parser.add_argument('--swagger', default=SWAGGER_PATH,
+                    help="Swagger file with x-amazon-apigateway-integration entries")
+parser.add_argument('--host', default='127.0.0.1')
+parser.add_argument('-p', '--port', type=int, default=3000)
+parser.add_argument('--stage', default='',
+                    help="Serve the API under /<stage>, like the deployed stage URL")
+parser.add_argument('--handler', default='index.handler',
+                    help="Handler of every function, as module.function")
+parser.add_argument('-c', '--concurrency', type=int, default=multiprocessing.cpu_count(),
+                    help="Maximum concurrent execution environments per function")
+parser.add_argument('--max-invocations', type=int, default=0,
+                    help="Recycle an execution environment after this many invocations (0: never)")
+parser.add_argument('--idle-timeout', type=float, default=600,
+                    help="Seconds an idle execution environment is kept warm")
+parser.add_argument('-t', '--timeout', type=float, default=3,
+                    help="Function timeout in seconds")
+parser.add_argument('--memory', type=int, default=128,
+                    help="Memory size reported to the handler context")
+parser.add_argument('--backlog', type=int, default=1024,
+                    help="Pending connections the listening socket accepts")
+parser.add_argument('-q', '--quiet', action='store_true',
+                    help="Don't log every request")
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING if args.quiet else logging.INFO, format='%(asctime)s %(message)s')
+
+    emulator = Emulator(load_routes(args.swagger), args)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    try:
+        loop.run_until_complete(serve(emulator, args))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # what asyncio.run (3.7+) does: connections still being served are cancelled before the loop closes
+        pending = (getattr(asyncio, 'all_tasks', None) or asyncio.Task.all_tasks)(loop)
+        for task in pending:
+            task.cancel()
+        if pending:
+            loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+
+        emulator.close()
+        loop.close()
@@ -0,0 +1,309 @@
+import os
+import sys
+import json
+import time
+import shutil
+import random
+import resource
+import argparse
+import tempfile
+import multiprocessing
+from queue import Empty
+
+
+script_path = os.path.dirname(os.path.realpath(__file__))
+project_path = os.path.dirname(script_path)
+
+BUCKET = "benchmark-artifacts"
+
+# synthetic dist/ trees: (file count, file size, compressible) groups per scenario
+scenarios = {
+    'tiny': [(2000, 1024, True)],
+    'large': [(4, 8 * 1024 * 1024, False)],
+    'mixed': [(500, 4 * 1024, True), (20, 256 * 1024, True), (2, 4 * 1024 * 1024, False)],
+}
+
+metrics = ['wall', 'cpu', 'peak_rss']
+
+
+def generate_function(root, groups, scale, seed=0):
+    rng = random.Random(seed)
+    code_dir = os.path.join(root, 'code')
+    os.makedirs(code_dir)
+
+    for group, (count, size, compressible) in enumerate(groups):
+        for i in range(max(1, int(count * scale))):
+            path = os.path.join(code_dir, 'pkg{}'.format(group), 'mod{:05d}{}'.format(i, '.py' if compressible else '.so'))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+            with open(path, 'wb') as f:
+                if compressible:
+                    words = [b'def', b'return', b'import', b'self', b'value', b'None', b'\n', b'    ']
+                    f.write(b' '.join(rng.choice(words) for _ in range(size // 5))[:size])
+                else:
+                    f.write(os.urandom(size))
+
+    with open(os.path.join(code_dir, 'index.py'), 'w') as f:
+        f.write('def handler(event, context):\n    return event\n')
+
+    with open(os.path.join(root, 'Makefile'), 'w') as f:
+        f.write('.PHONY: dist\ndist:\n\t@ [ -d dist ] || cp -r code dist\n')
+
+
+def peak_rss_reset():
+    # Linux lets a process reset its high-water mark, so every case gets its own peak
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except (IOError, OSError):
+        pass
+
+
+def peak_rss():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except (IOError, OSError):
+        pass
+
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def cpu_time():
+    usage = [resource.getrusage(who) for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN)]
+    return sum(u.ru_utime + u.ru_stime for u in usage)
+
+
+class ConnectionManager:
+    # stand-in for sceptre's ConnectionManager.call, counting the bytes sent to S3
+    def __init__(self):
+        import boto3
+
+        self.client = boto3.client('s3', region_name='us-east-1')
+        self.calls = 0
+        self.bytes_uploaded = 0
+
+    def call(self, service, command, kwargs=None):
+        kwargs = kwargs or {}
+        self.calls += 1
+
+        body = kwargs.get('Body')
+        if body is not None:
+            if hasattr(body, 'read'):
+                position = body.tell()
+                body.seek(0, os.SEEK_END)
+                self.bytes_uploaded += body.tell() - position
+                body.seek(position)
+            else:
+                self.bytes_uploaded += len(body)
+
+        return getattr(self.client, command)(**kwargs)
+
+
+def measure(name, connection_manager, func):
+    calls, uploaded = connection_manager.calls, connection_manager.bytes_uploaded
+    peak_rss_reset()
+    cpu, wall = cpu_time(), time.perf_counter()
+
+    func()
+
+    return name, {
+        'wall': round(time.perf_counter() - wall, 4),
+        'cpu': round(cpu_time() - cpu, 4),
+        'peak_rss': peak_rss(),
+        'bytes_uploaded': connection_manager.bytes_uploaded - uploaded,
+        's3_calls': connection_manager.calls - calls,
+    }
+
+
+def run_scenario(name, scale, queue):
+    for variable, value in [('AWS_ACCESS_KEY_ID', 'testing'), ('AWS_SECRET_ACCESS_KEY', 'testing'),
+                            ('AWS_DEFAULT_REGION', 'us-east-1')]:
+        os.environ[variable] = value
+
+    workdir = tempfile.mkdtemp(prefix='benchmark-{}-'.format(name))
+    os.chdir(workdir)
+    os.environ['S3_PACKAGE_CACHE_DIR'] = os.path.join(workdir, '.cache')
+    os.environ['S3_PACKAGE_REPORT'] = os.path.join(workdir, 'package-timings.json')
+
+    sys.path[:0] = [os.path.join(project_path, 'resolvers'), os.path.join(project_path, 'hooks')]
+
+    try:
+        from moto import mock_aws
+    except ImportError:
+        from moto import mock_s3 as mock_aws
+
+    import s3_package
+    import s3_version
+
+    fn_root_dir = os.path.join(workdir, 'src', name)
+    generate_function(fn_root_dir, scenarios[name], scale)
+
+    results = {}
+
+    with mock_aws():
+        connection_manager = ConnectionManager()
+        connection_manager.client.create_bucket(Bucket=BUCKET)
+        connection_manager.client.put_bucket_versioning(
+            Bucket=BUCKET, VersioningConfiguration={'Status': 'Enabled'}
+        )
+
+        argument = '{}^^{}/lambda/{}.zip'.format(fn_root_dir, BUCKET, name)
+
+        def package():
+            s3_package.S3Package(argument=argument, connection_manager=connection_manager, stack_config={}).run()
+
+        def resolve():
+            s3_version.S3Version(
+                argument='{}/lambda/{}.zip'.format(BUCKET, name), connection_manager=connection_manager, stack_config={}
+            ).resolve()
+
+        def touch():
+            with open(os.path.join(fn_root_dir, 'code', 'index.py'), 'a') as f:
+                f.write('# changed\n')
+
+        results.update([measure('package_cold', connection_manager, package)])
+        results.update([measure('package_cached', connection_manager, package)])
+
+        touch()
+        results.update([measure('package_incremental', connection_manager, package)])
+
+        # a new process starts with an empty artifact registry, so the resolver has to hit S3
+        import artifact_registry
+        artifact_registry.REGISTRY = None
+        results.update([measure('resolve', connection_manager, resolve)])
+
+    shutil.rmtree(workdir, ignore_errors=True)
+    queue.put(results)
+
+
+def run_isolated(context, scenario, scale, timeout):
+    queue = context.Queue()
+    process = context.Process(target=run_scenario, args=(scenario, scale, queue))
+    process.start()
+    deadline = time.monotonic() + timeout
+
+    # the child's traceback goes to stderr, here it only has to stop the wait
+    try:
+        while True:
+            exited = process.exitcode is not None
+
+            try:
+                return queue.get(timeout=0 if exited else 1)
+            except Empty:
+                if exited:
+                    raise Exception('Scenario {} failed, its process exited with {}'.format(scenario, process.exitcode))
+                if time.monotonic() > deadline:
+                    raise Exception('Scenario {} didn\'t finish within {}s'.format(scenario, timeout))
+    finally:
+        if process.is_alive():
+            process.terminate()
+        process.join()
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+
+    for scenario, cases in sorted(results.items()):
+        for case, values in sorted(cases.items()):
+            expected = baseline.get(scenario, {}).get(case)
+            if not expected:
+                print('WARNING no baseline for {}.{}, record one with --update-baseline'.format(scenario, case))
+                continue
+
+            for metric in metrics:
+                # ignore sub-10ms/sub-1MB noise, it's not a throughput regression
+                floor = 0.01 if metric != 'peak_rss' else 1024 * 1024
+                limit = max(expected[metric], floor) * (1 + tolerance)
+                if values[metric] > limit:
+                    regressions.append('{}.{} {}: {} > {:.4f} (baseline {})'.format(
+                        scenario, case, metric, values[metric], limit, expected[metric]
+                    ))
+
+            if values['bytes_uploaded'] > expected['bytes_uploaded'] * (1 + tolerance):
+                regressions.append('{}.{} bytes_uploaded: {} > baseline {}'.format(
+                    scenario, case, values['bytes_uploaded'], expected['bytes_uploaded']
+                ))
+
+    return regressions
+
+
+parser = argparse.ArgumentParser(description="Benchmark the s3_package hook and s3_version resolver against moto")
+parser.add_argument('-s', '--scenario', action='append', choices=sorted(scenarios),
+                    help="Scenario to run, can be repeated (default: all)")
+parser.add_argument('--scale', type=float, default=1.0,
+                    help="Multiplier for the number of generated files")
+parser.add_argument('-r', '--repeat', type=int, default=3,
+                    help="Runs per scenario, the best value of each metric is kept")
+parser.add_argument('-b', '--baseline', default=os.path.join(script_path, 'benchmark_baseline.json'),
+                    help="Baseline file to compare against")
+parser.add_argument('-t', '--tolerance', type=float, default=0.25,
+                    help="Allowed relative regression before failing")
+parser.add_argument('-u', '--update-baseline', action='store_true',
+                    help="Store the results as the new baseline")
+parser.add_argument('--timeout', type=float, default=600,
+                    help="Seconds a single scenario run may take")
+parser.add_argument('-o', '--output', default=os.path.join('reports', 'benchmark.json'),
+                    help="Where to write the results")
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+
+    # every scenario runs in a fresh process: clean module state, moto backend and RSS
+    context = multiprocessing.get_context('spawn')
+    results = {}
+
+    for scenario in args.scenario or sorted(scenarios):
+        runs = []
+
+        for _ in range(max(1, args.repeat)):
+            try:
+                runs.append(run_isolated(context, scenario, args.scale, args.timeout))
+            except Exception as e:
+                print('ERROR {}'.format(e))
+                sys.exit(2)
+
+        results[scenario] = {
+            case: {metric: min(run[case][metric] for run in runs) for metric in runs[0][case]}
+            for case in runs[0]
+        }
+
+        for case, values in results[scenario].items():
+            print('{:8} {:20} wall {wall:8.3f}s  cpu {cpu:8.3f}s  peak rss {rss:8.1f} MB  '
+                  'uploaded {up:10d} B  s3 calls {s3_calls}'.format(
+                      scenario, case, rss=values['peak_rss'] / 1024 / 1024, up=values['bytes_uploaded'], **values
+                  ))
+
+    os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump({'scale': args.scale, 'results': results}, f, indent=2, sort_keys=True)
+
+    try:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    except (IOError, ValueError) as e:
+        # without a baseline nothing can regress, that mustn't look like a passing run
+        if not args.update_baseline:
+            print('ERROR can\'t read baseline {} ({}), record one with --update-baseline'.format(args.baseline, e))
+            sys.exit(1)
+        baseline = {'scale': args.scale, 'results': {}}
+
+    if args.update_baseline:
+        baseline = {'scale': args.scale, 'results': dict(baseline.get('results', {}), **results)}
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print('Baseline updated: {}'.format(args.baseline))
+        sys.exit(0)
+
+    if baseline.get('scale') != args.scale:
+        print('Baseline was recorded with --scale {}, skipping comparison'.format(baseline.get('scale')))
+        sys.exit(0)
+
+    regressions = compare(results, baseline.get('results', {}), args.tolerance)
+
+    for regression in regressions:
+        print('REGRESSION {}'.format(regression))
+
+    sys.exit(1 if regressions else 0)
@@ -0,0 +1,233 @@
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+
+script_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(script_path, '..', 'hooks'))
+from lambda_archive import ArchiveWriter  # noqa: E402
+
+MB = 1024 * 1024
+
+# ms, and the Lambda deployment package limits
+default_budgets = {
+    'init': 1000,
+    'unzipped': 250 * MB,
+    'zipped': 50 * MB,
+}
+
+MARKER = '-- handler import --'
+
+# Imports the handler module like the Lambda runtime does and reports how long it took; the marker
+# separates the handler's imports from the interpreter's own startup imports on stderr. -X importtime
+# is 3.7+, older interpreters (the python3.6 runtime) get a finder that times every module's execution
+# and writes the same lines
+probe = '''
+import sys, time
+
+if sys.version_info < (3, 7):
+    stack = [0.0]
+
+    class TimedLoader:
+        def __init__(self, loader):
+            self.loader = loader
+
+        def __getattr__(self, name):
+            return getattr(self.loader, name)
+
+        def create_module(self, spec):
+            return self.loader.create_module(spec)
+
+        def exec_module(self, module):
+            stack.append(0.0)
+            start = time.perf_counter()
+            try:
+                self.loader.exec_module(module)
+            finally:
+                cumulative = time.perf_counter() - start
+                children = stack.pop()
+                stack[-1] += cumulative
+                sys.stderr.write('import time: %9d | %10d | %s%s\\n' % (
+                    (cumulative - children) * 1e6, cumulative * 1e6, '  ' * (len(stack) - 1), module.__name__))
+
+    class TimedFinder:
+        @classmethod
+        def find_spec(cls, name, path, target=None):
+            for finder in sys.meta_path:
+                if finder is not cls and hasattr(finder, 'find_spec'):
+                    spec = finder.find_spec(name, path, target)
+                    if spec is not None:
+                        if hasattr(spec.loader, 'exec_module'):
+                            spec.loader = TimedLoader(spec.loader)
+                        return spec
+            return None
+
+    sys.meta_path.insert(0, TimedFinder)
+
+sys.stderr.write('%s\\n' % sys.argv[3])
+sys.stderr.flush()
+start = time.perf_counter()
+module = __import__(sys.argv[1])
+getattr(module, sys.argv[2])
+sys.stdout.write(str(time.perf_counter() - start))
+'''
+
+
+class CountingSink:
+    def __init__(self):
+        self.size = 0
+
+    def write(self, data):
+        self.size += len(data)
+
+
+def tree_files(path):
+    for root, dirs, files in os.walk(path):
+        dirs[:] = sorted(d for d in dirs if d != '__pycache__')
+        for file in sorted(files):
+            if not file.endswith(('.pyc', '.pyo')):
+                yield os.path.join(root, file), os.path.relpath(os.path.join(root, file), path)
+
+
+def sizes(fn_root_dir):
+    unzipped = zipped = 0
+
+    # the layer counts against the unzipped limit too, but is zipped as its own artifact
+    for tree in ['dist', os.path.join('layer', 'python')]:
+        path = os.path.join(fn_root_dir, tree)
+        if not os.path.isdir(path):
+            continue
+
+        files = list(tree_files(path))
+        unzipped += sum(os.path.getsize(file) for file, _ in files)
+
+        if tree == 'dist':
+            sink = CountingSink()
+            with ArchiveWriter(sink) as archive:
+                archive.add_files(files)
+            zipped = sink.size
+
+    return unzipped, zipped
+
+
+def parse_importtime(stderr):
+    imports = []
+    lines = stderr.splitlines()
+
+    if MARKER in lines:
+        lines = lines[lines.index(MARKER) + 1:]
+
+    for line in lines:
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+
+        self_us, cumulative_us, name = line[len('import time:'):].split('|', 2)
+        imports.append({
+            'module': name.strip(),
+            'self': int(self_us) / 1000,
+            'cumulative': int(cumulative_us) / 1000,
+        })
+
+    return imports
+
+
+def profile(fn_root_dir, handler, python):
+    dist_dir = os.path.join(fn_root_dir, 'dist')
+    if not os.path.isdir(dist_dir):
+        raise Exception("{} has no dist/ directory, run `make` first".format(fn_root_dir))
+
+    module, function = handler.rsplit('.', 1)
+
+    # fresh interpreter with the same import path Lambda builds: the package root, then /opt/python
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([dist_dir, os.path.join(fn_root_dir, 'layer', 'python')]),
+               PYTHONDONTWRITEBYTECODE='1')
+    env.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    env.setdefault('AWS_LAMBDA_FUNCTION_NAME', os.path.basename(os.path.abspath(fn_root_dir)))
+
+    result = subprocess.run(
+        [python, '-X', 'importtime', '-s', '-c', probe, module, function, MARKER],
+        cwd=dist_dir, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True,
+    )
+
+    if result.returncode != 0:
+        raise Exception("Importing {} failed:\n{}".format(handler, result.stderr[-4000:]))
+
+    imports = parse_importtime(result.stderr)
+
+    # the handler module itself is always imported, an empty profile means the timing didn't work
+    if not imports:
+        raise Exception("No import profile from {} for {}:\n{}".format(python, handler, result.stderr[-4000:]))
+
+    unzipped, zipped = sizes(fn_root_dir)
+
+    return {
+        'init': round(float(result.stdout) * 1000, 3),
+        'unzipped': unzipped,
+        'zipped': zipped,
+        'imports': imports,
+    }
+
+
+def check(report, budgets):
+    failures = []
+
+    for metric, budget in sorted(budgets.items()):
+        if budget and report[metric] > budget:
+            failures.append('{} {} exceeds budget {}'.format(metric, report[metric], budget))
+
+    return failures
+
+
+parser = argparse.ArgumentParser(description="Profile the cold-start import of each function's dist/")
+parser.add_argument('functions', nargs='*',
+                    help="Function directories (default: every src/* directory with a Makefile)")
+parser.add_argument('--handler', default='index.handler',
+                    help="Handler to import, as module.function")
+parser.add_argument('--python', default=sys.executable,
+                    help="Interpreter to import the handler with")
+parser.add_argument('-n', '--top', type=int, default=10,
+                    help="Number of slowest imports to show")
+parser.add_argument('--init-budget', type=float, default=default_budgets['init'],
+                    help="Maximum init time in ms (0 disables the check)")
+parser.add_argument('--unzipped-budget', type=int, default=default_budgets['unzipped'],
+                    help="Maximum size of dist/ plus layer in bytes (0 disables the check)")
+parser.add_argument('--zipped-budget', type=int, default=default_budgets['zipped'],
+                    help="Maximum size of the zipped dist/ in bytes (0 disables the check)")
+parser.add_argument('-o', '--output',
+                    help="Write the full report as JSON to this file")
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+
+    src_path = os.path.join(script_path, '..', 'src')
+    functions = args.functions or sorted(
+        os.path.join(src_path, d) for d in os.listdir(src_path) if os.path.isfile(os.path.join(src_path, d, 'Makefile'))
+    )
+    budgets = {'init': args.init_budget, 'unzipped': args.unzipped_budget, 'zipped': args.zipped_budget}
+
+    reports = {}
+    failed = False
+
+    for fn_root_dir in functions:
+        name = os.path.basename(os.path.abspath(fn_root_dir))
+        report = reports[name] = profile(fn_root_dir, args.handler, args.python)
+
+        print('{}: init {:.1f} ms, unzipped {:.2f} MB, zipped {:.2f} MB'.format(
+            name, report['init'], report['unzipped'] / MB, report['zipped'] / MB
+        ))
+
+        for entry in sorted(report['imports'], key=lambda entry: entry['self'], reverse=True)[:args.top]:
+            print('  {self:9.3f} ms self {cumulative:9.3f} ms cumulative  {module}'.format(**entry))
+
+        for failure in check(report, budgets):
+            print('{}: BUDGET {}'.format(name, failure))
+            failed = True
+
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+        with open(args.output, 'w') as f:
+            json.dump({'budgets': budgets, 'functions': reports}, f, indent=2, sort_keys=True)
+
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,205 @@
+import os
+import sys
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import yaml
+from sceptre.cli import setup_logging, write
+from sceptre.environment import Environment
+from sceptre.stack_status import StackStatus
+
+
+script_path = os.path.dirname(os.path.realpath(__file__))
+project_path = os.path.dirname(script_path)
+
+SKIPPED = 'skipped'
+
+
+def leaf_stacks(environment):
+    if environment.is_leaf:
+        return list(environment.stacks.values())
+
+    return [stack for sub in environment.environments.values() for stack in leaf_stacks(sub)]
+
+
+def dependency_graph(stacks):
+    # stack.dependencies reads the stack config, where every !stack_output adds its target stack;
+    # stacks outside the environment being deployed are assumed to exist, like sceptre does
+    names = {stack.name for stack in stacks}
+    graph = {stack.name: sorted(set(stack.dependencies) & names) for stack in stacks}
+
+    remaining = dict(graph)
+    while remaining:
+        ready = [name for name, dependencies in remaining.items() if not set(dependencies) & set(remaining)]
+        if not ready:
+            raise Exception('Circular dependency between stacks: {}'.format(', '.join(sorted(remaining))))
+        for name in ready:
+            del remaining[name]
+
+    return graph
+
+
+def critical_path(graph):
+    # length of the longest chain of stacks waiting on each stack, those go first when slots are scarce
+    dependents = {name: [other for other, dependencies in graph.items() if name in dependencies] for name in graph}
+    lengths = {}
+
+    def length(name):
+        if name not in lengths:
+            lengths[name] = 1 + max([length(dependent) for dependent in dependents[name]] or [0])
+        return lengths[name]
+
+    return {name: length(name) for name in graph}
+
+
+class Deployment(object):
+    def __init__(self, stacks, graph, parallelism):
+        self.stacks = {stack.name: stack for stack in stacks}
+        self.graph = graph
+        lengths = critical_path(graph)
+        self.order = sorted(graph, key=lambda name: (-lengths[name], name))
+        self.parallelism = parallelism
+        self.statuses = {name: StackStatus.PENDING for name in graph}
+        self.timings = {name: {} for name in graph}
+        self.outputs = {}
+
+    def launch(self, name):
+        timing = self.timings[name]
+        timing['start'] = time.perf_counter()
+
+        try:
+            status = self.stacks[name].launch()
+        except Exception:
+            self.stacks[name].logger.exception('%s - Failed to launch', name)
+            status = StackStatus.FAILED
+
+        timing['launch'] = time.perf_counter() - timing['start']
+        return status
+
+    def describe_outputs(self, name):
+        start = time.perf_counter()
+        outputs = self.stacks[name].describe_outputs()
+        self.timings[name]['outputs'] = time.perf_counter() - start
+        return outputs
+
+    def run(self):
+        start = time.perf_counter()
+        futures = {}
+
+        def submit(executor):
+            for name in self.order:
+                dependencies = self.graph[name]
+                if self.statuses[name] != StackStatus.PENDING or name in futures.values():
+                    continue
+
+                statuses = [self.statuses[dependency] for dependency in dependencies]
+                if any(status not in [StackStatus.PENDING, StackStatus.COMPLETE] for status in statuses):
+                    self.statuses[name] = SKIPPED
+                elif all(status == StackStatus.COMPLETE for status in statuses):
+                    self.timings[name]['ready'] = time.perf_counter()
+                    futures[executor.submit(self.launch, name)] = name
+
+        # a stack is submitted as soon as everything it depends on is complete, the pool bounds parallelism
+        with ThreadPoolExecutor(max_workers=self.parallelism) as executor:
+            submit(executor)
+
+            while futures:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    self.statuses[futures.pop(future)] = future.result()
+
+                # skipping a stack can skip its dependents in turn
+                before = None
+                while before != self.statuses:
+                    before = dict(self.statuses)
+                    submit(executor)
+
+            # outputs of every stack, concurrently and through the connection managers the stacks share
+            complete = sorted(name for name, status in self.statuses.items() if status == StackStatus.COMPLETE)
+            self.outputs = dict(zip(complete, executor.map(self.describe_outputs, complete)))
+
+        for name, timing in self.timings.items():
+            if 'start' in timing:
+                timing['queued'] = timing['start'] - timing['ready']
+                timing['offset'] = timing['start'] - start
+
+        return time.perf_counter() - start
+
+
+def report(deployment, wall):
+    lines = ['{:40} {:>12} {:>9} {:>9} {:>9} {:>9}'.format(
+        'Stack', 'Status', 'Start', 'Queued', 'Launch', 'Outputs'
+    )]
+
+    # in the order the stacks started, stacks that never started last
+    order = sorted(deployment.graph, key=lambda name: (deployment.timings[name].get('offset', float('inf')), name))
+
+    for name in order:
+        timing = deployment.timings[name]
+        lines.append('{:40} {:>12} {:>9} {:>9} {:>9} {:>9}'.format(
+            name, deployment.statuses[name], *[
+                '{:.1f}s'.format(timing[key]) if key in timing else '-'
+                for key in ['offset', 'queued', 'launch', 'outputs']
+            ]
+        ))
+
+    lines.append('Total: {:.1f}s'.format(wall))
+    return '\n'.join(lines)
+
+
+def user_variables(args):
+    variables = {}
+
+    if args.var_file:
+        with open(args.var_file) as f:
+            variables.update(yaml.safe_load(f))
+
+    # --var options overwrite --var-file options, like sceptre's
+    for variable in args.var:
+        key, value = variable.split('=', 1)
+        variables[key] = value
+
+    return variables
+
+
+parser = argparse.ArgumentParser(
+    description="Launch every stack of a sceptre environment, independent stacks concurrently, "
+                "then print their outputs and a per-stack timing breakdown"
+)
+parser.add_argument('environment', nargs='?', default='dev')
+parser.add_argument('-j', '--parallelism', type=int, default=4,
+                    help="Maximum number of stacks launched at the same time")
+parser.add_argument('--dir', default=project_path,
+                    help="Sceptre project directory")
+parser.add_argument('--var', action='append', default=[],
+                    help="A variable to template into config files, as key=value")
+parser.add_argument('--var-file',
+                    help="A YAML file of variables to template into config files")
+parser.add_argument('--debug', action='store_true')
+parser.add_argument('--no-colour', action='store_true')
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    if args.parallelism < 1:
+        parser.error('--parallelism must be at least 1')
+
+    setup_logging(args.debug, args.no_colour)
+
+    variables = user_variables(args)
+    options = {'user_variables': variables} if variables else {}
+
+    environment = Environment(sceptre_dir=args.dir, environment_path=args.environment, options=options)
+    stacks = leaf_stacks(environment)
+    deployment = Deployment(stacks, dependency_graph(stacks), args.parallelism)
+
+    wall = deployment.run()
+
+    write(deployment.statuses, 'yaml', args.no_colour)
+
+    for name, outputs in sorted(deployment.outputs.items()):
+        write({name: outputs}, 'yaml')
+
+    print(report(deployment, wall))
+
+    sys.exit(0 if all(status == StackStatus.COMPLETE for status in deployment.statuses.values()) else 1)
@@ -0,0 +1,255 @@
+import os
+import sys
+import json
+import time
+import random
+import resource
+import argparse
+import importlib
+import subprocess
+import contextlib
+import multiprocessing
+
+import yaml
+
+from apigw_emulator import SWAGGER_PATH, SOURCE_PATH, SwaggerLoader, Context, load_routes, import_paths, proxy_event
+
+
+script_path = os.path.dirname(os.path.realpath(__file__))
+project_path = os.path.dirname(script_path)
+
+PERCENTILES = [50, 95, 99]
+USER_AGENTS = ['curl/7.61.0', 'Mozilla/5.0 (X11; Linux x86_64)', 'python-requests/2.20.0']
+
+
+def generate_events(function, count, seed, swagger_path):
+    # synthetic proxy events for every route of the function, with its declared query/path parameters
+    rng = random.Random(seed)
+
+    with open(swagger_path) as f:
+        swagger = yaml.load(f, Loader=SwaggerLoader)
+
+    routes = [route for route in load_routes(swagger_path) if route.function.lower() == function.lower()]
+    if not routes:
+        raise Exception("No aws_proxy route in {} points at {}".format(swagger_path, function))
+
+    def value():
+        return ''.join(rng.choice('abcdefghijklmnopqrstuvwxyz') for _ in range(rng.randint(0, 12)))
+
+    events = []
+
+    for i in range(count):
+        route = routes[i % len(routes)]
+        method = route.method if route.method != 'ANY' else 'GET'
+        operation = swagger['paths'][route.resource].get(method.lower()) or {}
+        parameters = operation.get('parameters', [])
+
+        path_parameters = {p['name']: value() or 'x' for p in parameters if p.get('in') == 'path'}
+        path = route.resource
+        for name, parameter in path_parameters.items():
+            path = path.replace('{' + name + '}', parameter)
+
+        query = '&'.join(
+            '{}={}'.format(p['name'], value()) for p in parameters
+            if p.get('in') == 'query' and (p.get('required') or rng.random() < 0.5)
+        )
+
+        headers = [('Host', 'localhost'), ('User-Agent', rng.choice(USER_AGENTS)), ('Accept', '*/*')]
+        target = '{}?{}'.format(path, query) if query else path
+
+        events.append(proxy_event(route, method, target, headers, b'', path_parameters, '', '127.0.0.1'))
+
+    return events
+
+
+def load_events(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def rss():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except (IOError, OSError):
+        pass
+
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def run_worker(task):
+    # one execution environment: import (cold start), then warm invocations of the slice
+    fn_root_dir, handler, events = task
+    sys.path[:0] = import_paths(fn_root_dir)
+    os.environ.setdefault('AWS_LAMBDA_FUNCTION_NAME', os.path.basename(fn_root_dir))
+    module_name, handler_name = handler.rsplit('.', 1)
+
+    rss_start = rss()
+    start = time.perf_counter()
+    function = getattr(importlib.import_module(module_name), handler_name)
+    init = time.perf_counter() - start
+
+    latencies = []
+    errors = 0
+    rss_warm = None
+
+    # handler logs still get serialized and written, just not to the terminal
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        for i, event in enumerate(events):
+            context = Context(os.environ['AWS_LAMBDA_FUNCTION_NAME'], str(i), 900, 128)
+            start = time.perf_counter()
+
+            try:
+                function(event, context)
+            except Exception:
+                errors += 1
+
+            latencies.append(time.perf_counter() - start)
+
+            if i == 0:
+                rss_warm = rss()
+
+    return {
+        'init': init,
+        'latencies': latencies,
+        'errors': errors,
+        'rss_start': rss_start,
+        'rss_warm': rss_warm or rss(),
+        'rss_end': rss(),
+    }
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(p / 100.0 * len(ordered))) - 1))]
+
+
+def summarize(results, wall):
+    latencies = [latency for result in results for latency in result['latencies']]
+    inits = [result['init'] for result in results]
+
+    summary = {
+        'invocations': len(latencies),
+        'errors': sum(result['errors'] for result in results),
+        'throughput': round(len(latencies) / wall, 1),
+        'cold_starts': len(results),
+        'init_mean_ms': round(sum(inits) / len(inits) * 1000, 3),
+        'latency_mean_ms': round(sum(latencies) / len(latencies) * 1000, 4),
+        'latency_max_ms': round(max(latencies) * 1000, 4),
+        # RSS growth across warm invocations, the first one excluded since it allocates lazily
+        'rss_growth': max(result['rss_end'] - result['rss_warm'] for result in results),
+        'rss_peak': max(result['rss_end'] for result in results),
+    }
+
+    for p in PERCENTILES:
+        summary['p{}_ms'.format(p)] = round(percentile(latencies, p) * 1000, 4)
+
+    return summary
+
+
+def split(events, size):
+    return [events[i:i + size] for i in range(0, len(events), size)]
+
+
+def commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=project_path, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+parser = argparse.ArgumentParser(description="Replay API Gateway proxy events against a function's handler")
+parser.add_argument('function', help="Function directory name under src/, e.g. hello")
+parser.add_argument('-e', '--events',
+                    help="JSON lines file with recorded proxy events (default: generated from the swagger file)")
+parser.add_argument('-n', '--invocations', type=int, default=5000,
+                    help="Number of invocations, the corpus is cycled when it is shorter")
+parser.add_argument('--seed', type=int, default=0,
+                    help="Seed for generated events, keep it fixed to compare commits")
+parser.add_argument('--record',
+                    help="Write the events used to this JSON lines file")
+parser.add_argument('--swagger', default=SWAGGER_PATH)
+parser.add_argument('--handler', default='index.handler')
+parser.add_argument('-p', '--processes', type=int, default=0,
+                    help="Replay across a pool of worker processes (default: in-process)")
+parser.add_argument('-r', '--recycle', type=int, default=0,
+                    help="Start a fresh worker (cold start) every N invocations; requires --processes")
+parser.add_argument('-o', '--output',
+                    help="Where to write the results (default: reports/replay-<function>.json)")
+parser.add_argument('-b', '--baseline',
+                    help="Results of a previous run to compare with")
+parser.add_argument('-t', '--tolerance', type=float, default=0.2,
+                    help="Allowed relative latency/RSS regression against the baseline")
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    if args.recycle and not args.processes:
+        parser.error('--recycle requires --processes')
+
+    fn_root_dir = os.path.join(SOURCE_PATH, args.function)
+
+    corpus = load_events(args.events) if args.events else generate_events(
+        args.function, min(args.invocations, 1000), args.seed, args.swagger
+    )
+    events = [corpus[i % len(corpus)] for i in range(args.invocations)]
+
+    if args.record:
+        with open(args.record, 'w') as f:
+            f.writelines(json.dumps(event, sort_keys=True) + '\n' for event in corpus)
+
+    start = time.perf_counter()
+
+    if args.processes:
+        size = args.recycle or -(-len(events) // args.processes)
+        tasks = [(fn_root_dir, args.handler, chunk) for chunk in split(events, size)]
+
+        # maxtasksperchild=1: every slice runs in a fresh interpreter, i.e. a new execution environment
+        with multiprocessing.get_context('spawn').Pool(args.processes, maxtasksperchild=1) as pool:
+            results = pool.map(run_worker, tasks, chunksize=1)
+    else:
+        results = [run_worker((fn_root_dir, args.handler, events))]
+
+    summary = summarize(results, time.perf_counter() - start)
+    mode = 'processes={},recycle={}'.format(args.processes, args.recycle) if args.processes else 'in-process'
+    report = {'function': args.function, 'commit': commit(), 'mode': mode, 'summary': summary}
+
+    print('{} ({}, commit {}): {invocations} invocations, {errors} errors, {throughput}/s, '
+          'p50 {p50_ms}ms p95 {p95_ms}ms p99 {p99_ms}ms max {latency_max_ms}ms, '
+          '{cold_starts} cold starts (init {init_mean_ms}ms), RSS +{rss_growth} bytes'.format(
+              args.function, mode, report['commit'], **summary
+          ))
+
+    output = args.output or os.path.join('reports', 'replay-{}.json'.format(args.function))
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+
+    if not args.baseline:
+        sys.exit(0)
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+
+    if baseline.get('mode') != mode:
+        print('Baseline was recorded in {} mode, skipping comparison'.format(baseline.get('mode')))
+        sys.exit(0)
+
+    regressions = []
+    for metric in ['p{}_ms'.format(p) for p in PERCENTILES] + ['rss_growth']:
+        before, after = baseline['summary'][metric], summary[metric]
+        # RSS noise below 1 MB is allocator jitter, not a leak
+        floor = 1024 * 1024 if metric == 'rss_growth' else 0.001
+        print('  {:12} {:>14} -> {:>14} ({:+.1%})'.format(metric, before, after, (after - before) / (before or 1)))
+        if after > max(before, floor) * (1 + args.tolerance):
+            regressions.append(metric)
+
+    if regressions:
+        print('REGRESSION against {} (commit {}): {}'.format(
+            args.baseline, baseline.get('commit'), ', '.join(regressions)
+        ))
+
+    sys.exit(1 if regressions else 0)
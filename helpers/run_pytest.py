@@ -1,29 +1,50 @@
 import os
+import re
+import sys
+import json
+import time
+import hashlib
+import tempfile
+import subprocess
 import multiprocessing
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 
 
 script_path = os.path.dirname(os.path.realpath(__file__))
+project_path = os.path.dirname(script_path)
+rcfile = '{}/.pylintrc'.format(script_path)
 
 arg_groups = {
     'default': [
         '--verbose',
         '--confcutdir=test',
-        '--pylint-rcfile={}/.pylintrc'.format(script_path),
-    ],
-    'lint': [
-        '--flake8',
-        '--pylint',
-        '--pylint-jobs={}'.format(multiprocessing.cpu_count()),
     ],
+    # collected in-process, reports are written afterwards so their time shows up on its own
     'coverage': [
         '--cov=.',
-        '--cov-report=term-missing',
-        '--cov-report=xml:reports/coverage.xml',
-        '--cov-report=html:reports/htmlcov',
+        '--cov-report=',
     ],
 }
 
+coverage_reports = [
+    ['report', '-m'],
+    ['xml', '-o', 'reports/coverage.xml'],
+    ['html', '-d', 'reports/htmlcov'],
+]
+
+linters = {
+    'flake8': [sys.executable, '-m', 'flake8'],
+    'pylint': [sys.executable, '-m', 'pylint', '--rcfile={}'.format(rcfile), '--output-format=parseable',
+               '--reports=n', '--score=n', '--jobs={}'.format(multiprocessing.cpu_count())],
+}
+
+# third-party code and build output (dist/ is a copy of code/ and src/shared) aren't linted
+LINT_EXCLUDE = {'dist', 'layer', 'reports', '__pycache__'}
+FLAKE8_CONFIGS = ['setup.cfg', 'tox.ini', '.flake8']
+# pylint exit status bits for a fatal message and a usage error
+PYLINT_FATAL = 1 | 32
+
 
 def set_environment(path):
     with open(path) as f:
@@ -36,6 +57,140 @@ def set_environment(path):
         os.environ[name] = value
 
 
+def lint_files():
+    files = []
+
+    for root, dirs, names in os.walk('.'):
+        dirs[:] = sorted(d for d in dirs if d not in LINT_EXCLUDE and not d.startswith('.'))
+        files.extend(os.path.normpath(os.path.join(root, name)) for name in sorted(names) if name.endswith('.py'))
+
+    return files
+
+
+def config_hash():
+    # linter configuration and versions: a change in any of them invalidates every cached result
+    digest = hashlib.sha256()
+
+    for path in [rcfile] + FLAKE8_CONFIGS:
+        if os.path.isfile(path):
+            with open(path, 'rb') as f:
+                digest.update(path.encode('utf-8') + b'\0' + f.read() + b'\0')
+
+    for command in linters.values():
+        digest.update(subprocess.check_output(command[:3] + ['--version']))
+
+    return digest.hexdigest()
+
+
+def file_key(path, salt):
+    # the path is part of the key, messages are reported against it
+    with open(path, 'rb') as f:
+        return hashlib.sha256(salt.encode('utf-8') + path.encode('utf-8') + b'\0' + f.read()).hexdigest()
+
+
+def set_key(keys):
+    # pylint follows imports, an edit to one file can change another file's findings: its results
+    # only hold for the whole linted set, and the requirements the layer it imports from comes from
+    digest = hashlib.sha256()
+
+    for path in sorted(keys):
+        digest.update(path.encode('utf-8') + b'\0' + keys[path].encode('utf-8') + b'\0')
+
+    if os.path.isfile('requirements.txt'):
+        with open('requirements.txt', 'rb') as f:
+            digest.update(f.read())
+
+    return digest.hexdigest()
+
+
+def load_cache(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+
+def save_cache(path, cache):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(cache, f)
+
+    os.replace(tmp_path, path)
+
+
+def run_linter(name, files):
+    # parseable output of both linters starts with the file path, messages are grouped by file
+    p = subprocess.Popen(linters[name] + files, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    output, _ = p.communicate()
+
+    output = output.decode('utf-8', 'replace')
+    messages = {path: [] for path in files}
+    pattern = re.compile(r'^(?:\./)?(.+?):\d+:')
+
+    for line in output.splitlines():
+        match = pattern.match(line)
+        path = os.path.normpath(match.group(1)) if match else None
+
+        if path in messages:
+            messages[path].append(line)
+
+    # the linter crashing isn't a finding, and mustn't be cached as a clean result
+    if name == 'pylint':
+        crashed = p.returncode & PYLINT_FATAL
+    else:
+        crashed = p.returncode and not any(messages.values())
+
+    if crashed:
+        raise Exception('{} failed:\n{}'.format(name, output))
+
+    return messages
+
+
+def lint(cache_path):
+    files = lint_files()
+    salt = config_hash()
+    keys = {path: file_key(path, salt) for path in files}
+    pylint_key = set_key(keys)
+
+    cached = load_cache(cache_path)
+    cached_flake8 = cached.get('flake8', {})
+    cached_pylint = cached.get('pylint', {})
+
+    # flake8 checks each file on its own, only changed files run again; pylint runs on every file
+    # as soon as any of them changed
+    results = {
+        'flake8': {path: cached_flake8[keys[path]] for path in files if keys[path] in cached_flake8},
+        'pylint': cached_pylint.get('messages') if cached_pylint.get('key') == pylint_key else None,
+    }
+    stale = {
+        'flake8': [path for path in files if path not in results['flake8']],
+        'pylint': files if results['pylint'] is None else [],
+    }
+    jobs = [name for name in linters if stale[name]]
+
+    if jobs:
+        with ThreadPoolExecutor(max_workers=len(jobs)) as executor:
+            outputs = dict(zip(jobs, executor.map(lambda name: run_linter(name, stale[name]), jobs)))
+
+        results['flake8'].update(outputs.get('flake8', {}))
+        results['pylint'] = outputs.get('pylint', results['pylint'])
+
+    # only the current files are kept, so the cache doesn't grow with every edit
+    save_cache(cache_path, {
+        'flake8': {keys[path]: results['flake8'][path] for path in files},
+        'pylint': {'key': pylint_key, 'messages': results['pylint']},
+    })
+
+    messages = [line for path in files for name in sorted(linters) for line in results[name][path]]
+    for line in messages:
+        print(line)
+
+    return not messages, {'files': len(files), 'linted': len(stale['flake8']), 'pylint': bool(stale['pylint'])}
+
+
 parser = argparse.ArgumentParser()
 parser.add_argument('-L', '--no-lint', action='store_false', default=True,
                     dest='lint', help="Skip file linting")
@@ -43,23 +198,58 @@ parser.add_argument('-C', '--no-cov', action='store_false', default=True,
                     dest='coverage', help="Skip coverage report")
 parser.add_argument('-e', '--env-file', nargs=1,
                     help="File to load environment variables from")
+parser.add_argument('-n', '--workers', type=int, default=1,
+                    help="Spread tests over this many pytest-xdist worker processes")
+parser.add_argument('--lint-cache',
+                    help="Lint results cache (default: .cache/lint/<directory name>.json in the project)")
 
 args, rest = parser.parse_known_args()
 
-pylint_args = ['pytest']
-pylint_args.extend(arg_groups['default'])
+if args.env_file:
+    set_environment(args.env_file)
 
-if args.lint:
-    pylint_args.extend(arg_groups['lint'])
+pytest_args = [sys.executable, '-m', 'pytest']
+pytest_args.extend(arg_groups['default'])
+
+if args.workers > 1:
+    pytest_args.extend(['-n', str(args.workers)])
 
 if args.coverage:
-    pylint_args.extend(arg_groups['coverage'])
+    pytest_args.extend(arg_groups['coverage'])
 else:
-    pylint_args.append('--no-cov')
+    pytest_args.append('--no-cov')
 
-pylint_args.extend(rest)
+pytest_args.extend(rest)
 
-if args.env_file:
-    set_environment(args.env_file)
+timings = {}
+passed = True
+
+if args.lint:
+    start = time.perf_counter()
+    cache_path = args.lint_cache or os.environ.get('LINT_CACHE') or os.path.join(
+        project_path, '.cache', 'lint', '{}.json'.format(os.path.basename(os.getcwd()))
+    )
+    passed, lint_stats = lint(cache_path)
+    timings['lint'] = dict(lint_stats, seconds=round(time.perf_counter() - start, 3))
+
+start = time.perf_counter()
+passed = subprocess.call(pytest_args) == 0 and passed
+timings['tests'] = {'seconds': round(time.perf_counter() - start, 3), 'workers': args.workers}
+
+if args.coverage and os.path.isfile('.coverage'):
+    start = time.perf_counter()
+    for report in coverage_reports:
+        subprocess.call([sys.executable, '-m', 'coverage'] + report)
+    timings['coverage'] = {'seconds': round(time.perf_counter() - start, 3)}
+
+print('Timings: {}'.format(', '.join(
+    '{} {:.2f}s'.format(phase, timing['seconds']) for phase, timing in timings.items()
+)) + (' ({linted}/{files} files linted by flake8, pylint {})'.format(
+    'ran' if timings['lint']['pylint'] else 'cached', **timings['lint']
+) if 'lint' in timings else ''))
+
+os.makedirs('reports', exist_ok=True)
+with open(os.path.join('reports', 'timings.json'), 'w') as f:
+    json.dump(timings, f, indent=2, sort_keys=True)
 
-os.execvp(pylint_args[0], pylint_args)
+sys.exit(0 if passed else 1)
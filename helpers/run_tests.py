@@ -0,0 +1,260 @@
+import os
+import sys
+import json
+import time
+import glob
+import shlex
+import shutil
+import hashlib
+import argparse
+import subprocess
+import multiprocessing
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+
+
+script_path = os.path.dirname(os.path.realpath(__file__))
+project_path = os.path.dirname(script_path)
+sys.path.append(os.path.join(script_path, '..', 'hooks'))
+from build_cache import BuildCache  # noqa: E402
+
+# inputs shared by every function's tests, a change in any of them runs all the suites again
+SHARED_INPUTS = [
+    'helpers/run_pytest.py',
+    'helpers/.pylintrc',
+    'helpers/cold_start.py',
+    'dependencies/test_requirements.txt',
+]
+
+REPORTS = ['junit.xml', 'coverage.xml']
+
+
+# Same manifest as the package build cache, plus the function's tests
+class TestCache(BuildCache):
+    SOURCES = BuildCache.SOURCES + ['test']
+
+    def __init__(self, cache_dir):
+        super(TestCache, self).__init__(cache_dir, 0)
+
+    def lookup(self, name, key):
+        directory = os.path.join(self.cache_dir, name)
+
+        try:
+            with open(os.path.join(directory, 'key.json')) as f:
+                if json.load(f)['key'] != key:
+                    return None
+        except (IOError, ValueError, KeyError):
+            return None
+
+        if not all(os.path.isfile(os.path.join(directory, report)) for report in REPORTS):
+            return None
+
+        return directory
+
+    def store(self, name, key, reports_dir):
+        directory = os.path.join(self.cache_dir, name)
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory)
+
+        for report in REPORTS:
+            shutil.copy2(os.path.join(reports_dir, report), directory)
+
+        # the key goes last, an interrupted store is a miss
+        with open(os.path.join(directory, 'key.json'), 'w') as f:
+            json.dump({'key': key}, f)
+
+
+def salt(pytest_args):
+    digest = hashlib.sha256(json.dumps(pytest_args).encode('utf-8'))
+
+    for path in SHARED_INPUTS:
+        try:
+            with open(os.path.join(project_path, path), 'rb') as f:
+                digest.update(f.read())
+        except IOError:
+            digest.update(b'\0missing')
+
+    return digest.hexdigest()
+
+
+def functions(names):
+    # only function directories have a Makefile, src/shared is copied into them
+    found = sorted(
+        os.path.basename(os.path.dirname(path))
+        for path in glob.glob(os.path.join(project_path, 'src', '*', 'Makefile'))
+    )
+
+    unknown = set(names) - set(found)
+    if unknown:
+        raise Exception('No function directory with a Makefile for: {}'.format(', '.join(sorted(unknown))))
+
+    return [name for name in found if not names or name in names]
+
+
+def run_suite(name, workers, pytest_args, cache, cache_key, log_dir):
+    fn_root_dir = os.path.join(project_path, 'src', name)
+    reports_dir = os.path.join(fn_root_dir, 'reports')
+
+    if cache:
+        cached = cache.lookup(name, cache_key)
+        if cached:
+            return {'status': 'cached', 'duration': 0, 'reports': cached}
+
+    # make only bootstraps dist/ and layer/ when they're missing, rebuild them so the suite runs
+    # against the sources and requirements the key was computed from
+    for tree in ['dist', 'layer']:
+        shutil.rmtree(os.path.join(fn_root_dir, tree), ignore_errors=True)
+
+    # a failing run must not leave the previous run's reports behind to be merged
+    for report in REPORTS:
+        if os.path.isfile(os.path.join(reports_dir, report)):
+            os.remove(os.path.join(reports_dir, report))
+
+    # run_pytest spreads the function's tests over its xdist workers, reports land in src/<fn>/reports/
+    args = ['--workers', str(workers), '--junitxml=reports/junit.xml'] + pytest_args
+    # make hands ARGS to the recipe's shell
+    make_args = 'ARGS={}'.format(' '.join(shlex.quote(arg) for arg in args))
+    start = time.perf_counter()
+
+    with open(os.path.join(log_dir, '{}.log'.format(name)), 'w') as log:
+        returncode = subprocess.call(
+            ['make', '--no-print-directory', '-C', fn_root_dir, 'test', make_args],
+            stdout=log, stderr=subprocess.STDOUT
+        )
+
+    result = {'status': 'passed' if returncode == 0 else 'failed', 'duration': time.perf_counter() - start}
+
+    if all(os.path.isfile(os.path.join(reports_dir, report)) for report in REPORTS):
+        result['reports'] = reports_dir
+
+        # only passing suites are cached, failures run again until they're fixed
+        if cache and returncode == 0:
+            cache.store(name, cache_key, reports_dir)
+
+    return result
+
+
+def merge_junit(results, output):
+    testsuites = ET.Element('testsuites')
+    totals = dict.fromkeys(['tests', 'failures', 'errors', 'skipped'], 0)
+
+    for name, result in sorted(results.items()):
+        if 'reports' not in result:
+            continue
+
+        root = ET.parse(os.path.join(result['reports'], 'junit.xml')).getroot()
+        for suite in [root] if root.tag == 'testsuite' else root.findall('testsuite'):
+            suite.set('name', name)
+            for case in suite.iter('testcase'):
+                case.set('classname', '{}.{}'.format(name, case.get('classname', '')))
+            for total in totals:
+                totals[total] += int(suite.get(total, 0))
+            testsuites.append(suite)
+
+    for total, value in totals.items():
+        testsuites.set(total, str(value))
+
+    ET.ElementTree(testsuites).write(output, encoding='utf-8', xml_declaration=True)
+    return totals
+
+
+def merge_coverage(results, output):
+    # one Cobertura report with the project as its only source, file names prefixed with src/<fn>/
+    coverage = ET.Element('coverage', version='merged', timestamp=str(int(time.time() * 1000)))
+    ET.SubElement(ET.SubElement(coverage, 'sources'), 'source').text = project_path
+    packages = ET.SubElement(coverage, 'packages')
+    totals = dict.fromkeys(['lines-valid', 'lines-covered', 'branches-valid', 'branches-covered'], 0)
+
+    for name, result in sorted(results.items()):
+        if 'reports' not in result:
+            continue
+
+        root = ET.parse(os.path.join(result['reports'], 'coverage.xml')).getroot()
+        for total in totals:
+            totals[total] += int(root.get(total, 0))
+
+        for package in root.iter('package'):
+            package.set('name', '.'.join(part for part in ['src', name, package.get('name', '')] if part))
+            for cls in package.iter('class'):
+                cls.set('filename', '/'.join(['src', name, cls.get('filename')]))
+            packages.append(package)
+
+    for total, value in totals.items():
+        coverage.set(total, str(value))
+
+    coverage.set('line-rate', '{:.4f}'.format(
+        totals['lines-covered'] / totals['lines-valid'] if totals['lines-valid'] else 1
+    ))
+    coverage.set('branch-rate', '{:.4f}'.format(
+        totals['branches-covered'] / totals['branches-valid'] if totals['branches-valid'] else 1
+    ))
+    coverage.set('complexity', '0')
+
+    ET.ElementTree(coverage).write(output, encoding='utf-8', xml_declaration=True)
+    return totals
+
+
+cpu_count = multiprocessing.cpu_count()
+
+parser = argparse.ArgumentParser(
+    description="Run every function's test suite concurrently, skipping functions whose sources, tests and "
+                "requirements are unchanged since they last passed, and merge their JUnit and coverage reports"
+)
+parser.add_argument('functions', nargs='*',
+                    help="Function directory names under src/ (default: all of them)")
+parser.add_argument('-j', '--jobs', type=int, default=min(4, cpu_count),
+                    help="Number of function suites run at the same time")
+parser.add_argument('-n', '--workers', type=int,
+                    help="pytest-xdist workers per suite (default: CPUs divided by --jobs)")
+parser.add_argument('--no-cache', action='store_false', default=True, dest='cache',
+                    help="Run every suite, even if it passed with the same inputs")
+parser.add_argument('-o', '--output', default=os.path.join(project_path, 'reports'),
+                    help="Directory for the merged junit.xml and coverage.xml, and the suite logs")
+
+if __name__ == '__main__':
+    args, pytest_args = parser.parse_known_args()
+    if args.jobs < 1:
+        parser.error('--jobs must be at least 1')
+
+    workers = args.workers or max(1, cpu_count // args.jobs)
+    names = functions(args.functions)
+
+    log_dir = os.path.join(args.output, 'tests')
+    os.makedirs(log_dir, exist_ok=True)
+
+    cache = TestCache(os.environ.get('TEST_CACHE_DIR', os.path.join(project_path, '.cache', 'tests'))) \
+        if args.cache else None
+    cache_salt = salt(pytest_args)
+    keys = {
+        name: cache.manifest(os.path.join(project_path, 'src', name), cache_salt) if cache else None for name in names
+    }
+
+    start = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=args.jobs) as executor:
+        results = dict(zip(names, executor.map(
+            lambda name: run_suite(name, workers, pytest_args, cache, keys[name], log_dir), names
+        )))
+
+    wall = time.perf_counter() - start
+
+    for name, result in sorted(results.items()):
+        if result['status'] == 'failed':
+            with open(os.path.join(log_dir, '{}.log'.format(name))) as f:
+                print('==== {} ===='.format(name))
+                print(f.read())
+
+    junit = merge_junit(results, os.path.join(args.output, 'junit.xml'))
+    coverage = merge_coverage(results, os.path.join(args.output, 'coverage.xml'))
+
+    for name, result in sorted(results.items()):
+        print('{:30} {:>8} {:>8.1f}s'.format(name, result['status'], result['duration']))
+
+    print('{} suites in {:.1f}s ({} cached): {tests} tests, {failures} failures, {errors} errors, {skipped} skipped; '
+          'coverage {:.1%} -> {}'.format(
+              len(results), wall, sum(result['status'] == 'cached' for result in results.values()),
+              coverage['lines-covered'] / coverage['lines-valid'] if coverage['lines-valid'] else 1,
+              args.output, **junit
+          ))
+
+    sys.exit(1 if any(result['status'] == 'failed' for result in results.values()) else 0)
@@ -0,0 +1,131 @@
+import hashlib, json, os, shutil, tempfile
+
+
+# Size-bounded LRU cache of packaged lambda archives, keyed by a manifest hash of
+# everything that feeds a function build so a hit can skip `make` and zipping
+class BuildCache:
+    # ../shared is the handler runtime every function Makefile copies into dist/
+    SOURCES = ["code", "requirements.txt", "Makefile", "../shared"]
+
+    def __init__(self, cache_dir, max_size):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+
+    @classmethod
+    def from_environment(cls):
+        return cls(
+            os.environ.get("S3_PACKAGE_CACHE_DIR", os.path.join(".cache", "s3_package")),
+            int(os.environ.get("S3_PACKAGE_CACHE_SIZE", 1024 * 1024 * 1024)),
+        )
+
+    def manifest(self, fn_root_dir, salt=""):
+        digest = hashlib.sha256(salt.encode("utf-8"))
+
+        for source in self.SOURCES:
+            path = os.path.join(fn_root_dir, source)
+
+            if os.path.isdir(path):
+                files = sorted(
+                    os.path.join(root, file)
+                    for root, _, files in os.walk(path)
+                    for file in files
+                )
+            elif os.path.isfile(path):
+                files = [path]
+            else:
+                continue
+
+            for file in files:
+                digest.update(os.path.relpath(file, fn_root_dir).encode("utf-8"))
+                digest.update(b"\0")
+                digest.update(str(os.stat(file).st_mode & 0o777).encode("utf-8"))
+                digest.update(b"\0")
+                with open(file, "rb") as f:
+                    for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                        digest.update(chunk)
+                digest.update(b"\0")
+
+        return digest.hexdigest()
+
+    def get(self, key):
+        archive, metadata = self._paths(key)
+
+        try:
+            with open(metadata) as f:
+                meta = json.load(f)
+        except (IOError, ValueError):
+            return None, None
+
+        if not os.path.isfile(archive):
+            return None, None
+
+        # bump recency for LRU eviction
+        os.utime(archive, None)
+        os.utime(metadata, None)
+
+        return archive, meta
+
+    def put(self, key, fileobj, meta):
+        archive, metadata = self._paths(key)
+        self._store(archive, metadata, fileobj, meta)
+        self.evict()
+
+        return archive
+
+    def previous(self, fn_root_dir):
+        name = hashlib.sha256(os.path.abspath(fn_root_dir).encode("utf-8")).hexdigest()
+        base = os.path.join(self.cache_dir, "previous", name)
+
+        return base + ".zip", base + ".json"
+
+    def remember(self, fn_root_dir, fileobj, index):
+        # last archive built for a function, kept apart from (and never evicted with) cache entries
+        archive, metadata = self.previous(fn_root_dir)
+        self._store(archive, metadata, fileobj, index)
+
+    def evict(self):
+        entries = {}
+
+        for name in os.listdir(self.cache_dir):
+            key, ext = os.path.splitext(name)
+            if ext not in [".zip", ".json"]:
+                continue
+            stat = os.stat(os.path.join(self.cache_dir, name))
+            size, mtime = entries.get(key, (0, 0))
+            entries[key] = (size + stat.st_size, max(mtime, stat.st_mtime))
+
+        total = sum(size for size, _ in entries.values())
+
+        for key, (size, _) in sorted(entries.items(), key=lambda e: e[1][1]):
+            if total <= self.max_size:
+                break
+
+            for path in self._paths(key):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            total -= size
+
+    def _store(self, archive, metadata, fileobj, meta):
+        directory = os.path.dirname(archive)
+        os.makedirs(directory, exist_ok=True)
+
+        # write to temporary names first so concurrent readers never see partial entries
+        fd, tmp_archive = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            fileobj.seek(0)
+            shutil.copyfileobj(fileobj, f)
+
+        fd, tmp_metadata = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(meta, f)
+
+        os.replace(tmp_archive, archive)
+        os.replace(tmp_metadata, metadata)
+
+    def _paths(self, key):
+        return (
+            os.path.join(self.cache_dir, "{}.zip".format(key)),
+            os.path.join(self.cache_dir, "{}.json".format(key)),
+        )
@@ -0,0 +1,212 @@
+import hashlib, json, os, stat, struct, threading, zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# static timestamp to keep same ZIP checksum on same files
+DATE_TIME = (2018, 1, 1, 0, 0, 0)
+DEFAULT_LEVEL = 6
+DEFAULT_WORKERS = os.cpu_count() or 1
+
+# payloads that are already compressed, deflating them again only burns CPU
+STORED_EXTENSIONS = {
+    ".zip", ".whl", ".egg", ".jar", ".gz", ".tgz", ".bz2", ".xz", ".lzma", ".zst", ".7z",
+    ".png", ".jpg", ".jpeg", ".gif", ".webp", ".mp3", ".mp4", ".woff", ".woff2",
+}
+
+ZIP_STORED = 0
+ZIP_DEFLATED = 8
+
+LOCAL_HEADER = struct.Struct("<4s2B4HL2L2H")
+CENTRAL_HEADER = struct.Struct("<4s4B4HL2L5H2L")
+END_OF_ARCHIVE = struct.Struct("<4s4H2LH")
+
+
+def dos_date_time(date_time):
+    year, month, day, hour, minute, second = date_time
+    return (
+        (year - 1980) << 9 | month << 5 | day,
+        hour << 11 | minute << 5 | second // 2,
+    )
+
+
+# Minimal, append-only ZIP writer: every entry is fully described by its index record, so an
+# entry copied raw from a previous archive is byte-identical to one compressed from scratch
+class ArchiveWriter:
+    def __init__(self, fileobj, level=DEFAULT_LEVEL, previous=None, workers=DEFAULT_WORKERS):
+        self.fileobj = fileobj
+        self.level = level
+        self.previous = previous
+        self.workers = workers
+        self.offset = 0
+        self.entries = []
+        self.reused = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *_):
+        if exc_type is None:
+            self.close()
+
+    def add_files(self, files):
+        # zlib releases the GIL, so entries are compressed concurrently and written in order;
+        # the window of in-flight entries bounds how many file contents are held in memory
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            pending = deque()
+
+            for path, arcname in files:
+                pending.append(executor.submit(self.prepare, path, arcname))
+
+                if len(pending) >= self.workers * 2:
+                    self.write_entry(*pending.popleft().result())
+
+            while pending:
+                self.write_entry(*pending.popleft().result())
+
+    def prepare(self, path, arcname):
+        with open(path, "rb") as f:
+            data = f.read()
+
+        # only the executable bit is kept, so the archive doesn't depend on the local umask
+        mode = 0o755 if os.stat(path).st_mode & 0o111 else 0o644
+
+        entry = {
+            "name": arcname,
+            "sha256": hashlib.sha256(data).hexdigest(),
+            "external_attr": (stat.S_IFREG | mode) << 16,
+        }
+
+        raw = self.previous.lookup(entry) if self.previous else None
+
+        if raw is not None:
+            return raw[0], raw[1], True
+
+        payload = None
+
+        if self.level and os.path.splitext(arcname)[1].lower() not in STORED_EXTENSIONS:
+            compressor = zlib.compressobj(self.level, zlib.DEFLATED, -15)
+            payload = compressor.compress(data) + compressor.flush()
+
+        # store entries that don't shrink, e.g. stripped shared objects
+        if payload is None or len(payload) >= len(data):
+            method, payload = ZIP_STORED, data
+        else:
+            method = ZIP_DEFLATED
+
+        entry.update({
+            "method": method,
+            "crc": zlib.crc32(data) & 0xFFFFFFFF,
+            "size": len(data),
+            "compressed_size": len(payload),
+        })
+
+        return entry, payload, False
+
+    def write_entry(self, entry, payload, reused=False):
+        name = entry["name"].encode("utf-8")
+        date, time = dos_date_time(DATE_TIME)
+
+        entry = dict(entry, offset=self.offset, data_offset=self.offset + LOCAL_HEADER.size + len(name))
+
+        self.write(LOCAL_HEADER.pack(
+            b"PK\x03\x04", 20, 0, self.flags(name), entry["method"], time, date,
+            entry["crc"], entry["compressed_size"], entry["size"], len(name), 0,
+        ))
+        self.write(name)
+        self.write(payload)
+
+        self.entries.append(entry)
+        self.reused += reused
+
+    def close(self):
+        date, time = dos_date_time(DATE_TIME)
+        start = self.offset
+
+        if len(self.entries) > 0xFFFF or start > 0xFFFFFFFF:
+            raise Exception("Archive too large, ZIP64 is not supported for lambda packages")
+
+        for entry in self.entries:
+            name = entry["name"].encode("utf-8")
+            self.write(CENTRAL_HEADER.pack(
+                b"PK\x01\x02", 20, 3, 20, 0, self.flags(name), entry["method"], time, date,
+                entry["crc"], entry["compressed_size"], entry["size"], len(name), 0, 0, 0, 0,
+                entry["external_attr"], entry["offset"],
+            ))
+            self.write(name)
+
+        self.write(END_OF_ARCHIVE.pack(
+            b"PK\x05\x06", 0, 0, len(self.entries), len(self.entries), self.offset - start, start, 0,
+        ))
+
+    def index(self):
+        return {
+            "level": self.level,
+            "zlib": zlib.ZLIB_VERSION,
+            "entries": {entry["name"]: entry for entry in self.entries},
+        }
+
+    def write(self, data):
+        self.fileobj.write(data)
+        self.offset += len(data)
+
+    @staticmethod
+    def flags(name):
+        try:
+            name.decode("ascii")
+            return 0
+        except UnicodeDecodeError:
+            return 0x800
+
+
+# Previous archive plus its per-entry index, used to copy unchanged compressed entries verbatim
+class PreviousArchive:
+    def __init__(self, archive_path, index_path, level):
+        self.fileobj = None
+        self.entries = {}
+        self.lock = threading.Lock()
+
+        try:
+            with open(index_path) as f:
+                index = json.load(f)
+        except (IOError, ValueError):
+            return
+
+        # raw deflate streams are only reusable when produced with the same settings
+        if index.get("level") != level or index.get("zlib") != zlib.ZLIB_VERSION:
+            return
+
+        try:
+            self.fileobj = open(archive_path, "rb")
+        except IOError:
+            return
+
+        self.entries = index.get("entries", {})
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def lookup(self, entry):
+        previous = self.entries.get(entry["name"])
+
+        if (
+            previous is None
+            or previous["sha256"] != entry["sha256"]
+            or previous["external_attr"] != entry["external_attr"]
+        ):
+            return None
+
+        with self.lock:
+            self.fileobj.seek(previous["data_offset"])
+            payload = self.fileobj.read(previous["compressed_size"])
+
+        if len(payload) != previous["compressed_size"]:
+            return None
+
+        return previous, payload
+
+    def close(self):
+        if self.fileobj:
+            self.fileobj.close()
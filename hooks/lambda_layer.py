@@ -0,0 +1,81 @@
+import hashlib, os, posixpath, re, subprocess, sys
+
+REQUIREMENTS = "requirements.txt"
+LAYER_PREFIX = "layers"
+DEFAULT_RUNTIME = "python3.6"
+
+# name[extras]==version, with optional environment markers and --hash options
+PINNED = re.compile(r"^[A-Za-z0-9][A-Za-z0-9._-]*(\[[^\]]*\])?\s*===?\s*[^\s;,*<>=!~]+\s*(;[^-]*)?(\s+--hash=\S+)*$")
+RUNTIME = re.compile(r"^python(\d+)\.(\d+)$")
+
+
+def requirement_lines(path):
+    with open(path) as f:
+        content = f.read().replace("\\\n", " ")
+
+    return sorted({" ".join(line.split("#", 1)[0].split()) for line in content.splitlines()} - {""})
+
+
+# Content address of a function's third-party dependencies: the normalized requirement set,
+# shared by the packaging hook and the lambda_functions template so both agree on the layer key.
+# The set is installed with --no-deps, so it has to be complete and pinned (pip freeze output)
+# for the hash to identify what ends up in the layer
+def requirements_hash(fn_root_dir):
+    path = os.path.join(fn_root_dir, REQUIREMENTS)
+
+    if not os.path.isfile(path):
+        return None
+
+    requirements = requirement_lines(path)
+
+    if not requirements:
+        return None
+
+    unpinned = [line for line in requirements if not PINNED.match(line)]
+    if unpinned:
+        raise Exception("{} has requirements not pinned with ==: {}".format(path, ", ".join(unpinned)))
+
+    return hashlib.sha256("\n".join(requirements).encode("utf-8")).hexdigest()
+
+
+# py36 for a Lambda runtime name (python3.6) or an interpreter named after one, otherwise the
+# interpreter is asked; wheels and bytecode in a layer only work on the version they were built for
+def python_tag(python):
+    match = RUNTIME.match(os.path.basename(python))
+
+    if match:
+        return "py{}{}".format(*match.groups())
+
+    return subprocess.check_output(
+        [python, "-c", "import sys; print('py{}{}'.format(*sys.version_info))"]
+    ).decode("utf-8").strip()
+
+
+# Runtime of the function in fn_root_dir (src/<name lowercased>), from the LambdaDefaults and
+# LambdaSettings.<Name> the lambda_functions template creates it with; None when the stack
+# doesn't define it
+def function_runtime(sceptre_user_data, fn_root_dir):
+    directory = os.path.basename(os.path.normpath(fn_root_dir))
+
+    for name in sceptre_user_data.get("LambdaFunctionNames", []):
+        if name.lower() == directory:
+            settings = dict(sceptre_user_data.get("LambdaDefaults", {}))
+            settings.update(sceptre_user_data.get("LambdaSettings", {}).get(name, {}))
+            return settings.get("Runtime", DEFAULT_RUNTIME)
+
+    return None
+
+
+def layer_id(fn_root_dir, python):
+    digest = requirements_hash(fn_root_dir)
+    return None if digest is None else "{}-{}".format(digest, python_tag(python))
+
+
+def layer_key(s3_key, layer):
+    return posixpath.join(posixpath.dirname(s3_key), LAYER_PREFIX, "{}.zip".format(layer))
+
+
+# used by the function Makefiles to find a requirement set in the local dependency store, under
+# the same id the layer is published with
+if __name__ == "__main__":
+    print(layer_id(sys.argv[1], sys.argv[2]) or "")
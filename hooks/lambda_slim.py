@@ -0,0 +1,123 @@
+import calendar, fnmatch, os, shutil, subprocess
+from functools import lru_cache
+from lambda_archive import DATE_TIME
+
+RULES_FILE = ".slimignore"
+
+# gitignore-like: a trailing / only matches directories, patterns with a / match the relative
+# path, the rest match the file name, ! keeps a path back, and the last matching rule wins.
+# Paths are relative to where the runtime imports from: dist/, or layer/python/ for a layer. Test
+# directories are only pruned at that top level (stray test packages from sdists), packages nested
+# in a dependency can be imported at runtime (add "tests/" to a .slimignore to prune them everywhere)
+DEFAULT_RULES = [
+    "__pycache__/",
+    "*.py[co]",
+    "*.dist-info/",
+    "*.egg-info/",
+    "/tests/",
+    "/test/",
+    "docs/",
+    "*.pyi",
+    "*.pyx",
+    "*.c",
+    "*.h",
+]
+
+
+def load_rules(fn_root_dir):
+    rules = list(DEFAULT_RULES)
+
+    try:
+        with open(os.path.join(fn_root_dir, RULES_FILE)) as f:
+            rules.extend(line.strip() for line in f if line.strip() and not line.startswith("#"))
+    except IOError:
+        pass
+
+    return rules
+
+
+def pruned(rules, path, is_dir):
+    result = False
+
+    for rule in rules:
+        keep = rule.startswith("!")
+        pattern = rule.lstrip("!")
+
+        if pattern.endswith("/"):
+            if not is_dir:
+                continue
+            pattern = pattern.rstrip("/")
+
+        subject = path if "/" in pattern else os.path.basename(path)
+
+        if fnmatch.fnmatchcase(subject, pattern.lstrip("/")):
+            result = not keep
+
+    return result
+
+
+def prune(path, rules):
+    removed = 0
+
+    for root, dirs, files in os.walk(path):
+        relroot = os.path.relpath(root, path).replace(os.sep, "/")
+        relroot = "" if relroot == "." else relroot + "/"
+
+        for d in list(dirs):
+            if pruned(rules, relroot + d, True):
+                shutil.rmtree(os.path.join(root, d))
+                dirs.remove(d)
+                removed += 1
+
+        for file in files:
+            if pruned(rules, relroot + file, False):
+                os.remove(os.path.join(root, file))
+                removed += 1
+
+    return removed
+
+
+# on PATH isn't enough, a pyenv shim for a version that isn't installed is there too
+@lru_cache(maxsize=None)
+def runnable(python):
+    if not shutil.which(python):
+        return False
+
+    try:
+        return subprocess.call([python, "-c", ""], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL) == 0
+    except OSError:
+        return False
+
+
+def precompile(path, python, runtime_dir, sourceless=False):
+    # sources get the archive timestamp before compiling, so the mtime recorded in each .pyc matches
+    # the extracted file on Lambda (and the .pyc bytes are reproducible)
+    epoch = calendar.timegm(DATE_TIME)
+    sources = [
+        os.path.join(root, file)
+        for root, _, files in os.walk(path)
+        for file in files
+        if file.endswith(".py")
+    ]
+
+    for source in sources:
+        os.utime(source, (epoch, epoch))
+
+    # SOURCE_DATE_EPOCH would switch to hash-based .pyc files, which are slower to validate
+    env = {name: value for name, value in os.environ.items() if name != "SOURCE_DATE_EPOCH"}
+    command = [python, "-m", "compileall", "-q", "-f", "-j", "0", "-d", runtime_dir] + (["-b"] if sourceless else []) + [path]
+
+    p = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, env=env)
+    output, _ = p.communicate()
+
+    if p.returncode != 0:
+        raise Exception(
+            "Failed to precompile {} with {}:\n{}".format(path, python, output.decode("utf-8", "replace"))
+        )
+
+    # legacy-location .pyc files next to the removed sources are importable on their own
+    if sourceless:
+        for source in sources:
+            os.remove(source)
+
+    return len(sources)
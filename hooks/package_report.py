@@ -0,0 +1,99 @@
+import json, os, tempfile, threading, time
+from contextlib import contextmanager
+
+
+# Per-function packaging instrumentation: wall time per phase plus size/count stats
+class Timings:
+    def __init__(self, name):
+        self.name = name
+        self.phases = {}
+        self.stats = {}
+        self.lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.finished = None
+
+    @contextmanager
+    def span(self, phase):
+        start = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            self.add_time(phase, time.perf_counter() - start)
+
+    def add_time(self, phase, seconds):
+        with self.lock:
+            self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    def set(self, **stats):
+        with self.lock:
+            self.stats.update(stats)
+
+    def finish(self):
+        self.finished = time.perf_counter()
+
+    def to_dict(self):
+        with self.lock:
+            stats = dict(self.stats)
+            phases = {phase: round(seconds, 4) for phase, seconds in self.phases.items()}
+
+        if stats.get("bytes_in"):
+            stats["compression_ratio"] = round(stats.get("bytes_out", 0) / stats["bytes_in"], 4)
+
+        # phases may nest (checksum runs inside archive), so the total is wall time
+        total = (self.finished or time.perf_counter()) - self.started
+
+        return dict(stats, phases=phases, total=round(total, 4))
+
+    def summary(self):
+        report = self.to_dict()
+
+        phases = ", ".join(
+            "{} {:.2f}s".format(phase, seconds) for phase, seconds in report["phases"].items()
+        ) or "no phases"
+        sizes = ""
+        if "bytes_in" in report:
+            sizes = " | {} files, {} -> {} bytes".format(
+                report.get("files", 0), report["bytes_in"], report.get("bytes_out", 0)
+            )
+
+        status = report.get("status", "not packaged")
+        if report.get("version"):
+            status += " (version {})".format(report["version"])
+
+        return "{}: {} | {}{} | total {:.2f}s".format(self.name, status, phases, sizes, report["total"])
+
+
+# Machine-readable report merged across hook invocations, one record per function root
+class PackageReport:
+    LOCK = threading.Lock()
+
+    def __init__(self, path):
+        self.path = path
+
+    @classmethod
+    def from_environment(cls):
+        return cls(os.environ.get("S3_PACKAGE_REPORT", os.path.join("reports", "package-timings.json")))
+
+    def write(self, timings):
+        with self.LOCK:
+            try:
+                with open(self.path) as f:
+                    report = json.load(f)
+            except (IOError, ValueError):
+                report = {}
+
+            functions = report.setdefault("functions", {})
+            for t in timings:
+                functions[t.name] = dict(t.to_dict(), time=time.time())
+
+            report["updated"] = time.time()
+
+            directory = os.path.dirname(self.path) or "."
+            os.makedirs(directory, exist_ok=True)
+
+            fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+            with os.fdopen(fd, "w") as f:
+                json.dump(report, f, indent=2, sort_keys=True)
+
+            os.replace(tmp_path, self.path)
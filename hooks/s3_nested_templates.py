@@ -0,0 +1,67 @@
+import importlib.util, os
+from concurrent.futures import ThreadPoolExecutor
+from sceptre.hooks import Hook
+from botocore.exceptions import ClientError
+
+
+class S3NestedTemplates(Hook):
+    NAME = "s3_nested_templates"
+    DELIMITER = "^^"
+    UPLOAD_WORKERS = 8
+
+    def __init__(self, *args, **kwargs):
+        super(S3NestedTemplates, self).__init__(*args, **kwargs)
+
+    def run(self):
+        template_path, s3_bucket = self.argument.split(self.DELIMITER, 1)
+
+        # the stack's own template renders the nested ones, so both agree on their content-addressed keys
+        spec = importlib.util.spec_from_file_location(
+            "{}_nested".format(os.path.splitext(os.path.basename(template_path))[0]), template_path
+        )
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+
+        templates = module.nested_templates(self.stack_config.get("sceptre_user_data", {}))
+
+        self.logger.debug(
+            "[{}] {} nested templates rendered from {}".format(self.NAME, len(templates), template_path)
+        )
+
+        if templates:
+            with ThreadPoolExecutor(max_workers=min(self.UPLOAD_WORKERS, len(templates))) as executor:
+                list(executor.map(
+                    lambda item: self.upload(s3_bucket, *item), sorted(templates.items())
+                ))
+
+    def upload(self, s3_bucket, s3_key, body):
+        # keys are content hashes, an existing object already has this exact body
+        try:
+            self.connection_manager.call(
+                service="s3",
+                command="head_object",
+                kwargs={"Bucket": s3_bucket, "Key": s3_key},
+            )
+
+            self.logger.debug(
+                "[{}] skip s3://{}/{} - already uploaded".format(self.NAME, s3_bucket, s3_key)
+            )
+            return
+        except ClientError as e:
+            if e.response["Error"]["Code"] not in ["404", "NoSuchKey"]:
+                raise e
+
+        self.logger.info(
+            "[{}] uploading nested template to s3://{}/{}".format(self.NAME, s3_bucket, s3_key)
+        )
+
+        self.connection_manager.call(
+            service="s3",
+            command="put_object",
+            kwargs={
+                "Bucket": s3_bucket,
+                "Key": s3_key,
+                "Body": body.encode("utf-8"),
+                "ContentType": "application/x-yaml",
+            },
+        )
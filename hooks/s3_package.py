@@ -1,47 +1,120 @@
-import hashlib, os, subprocess, zipfile
+import hashlib, os, shlex, subprocess, tempfile, threading, time
 from base64 import b64encode
+from concurrent.futures import ThreadPoolExecutor
 from sceptre.hooks import Hook
 from sceptre.resolvers import Resolver
 from botocore.exceptions import ClientError
-from datetime import datetime
 from shutil import rmtree
-try:
-    from subprocess import DEVNULL
-except ImportError:
-    DEVNULL = open(os.devnull, 'wb')
+from artifact_registry import registry
+from build_cache import BuildCache
+from lambda_layer import function_runtime, layer_id, layer_key, python_tag
+from lambda_archive import ArchiveWriter, PreviousArchive, DEFAULT_LEVEL, DEFAULT_WORKERS
+from lambda_slim import RULES_FILE, load_rules, prune, precompile, runnable
+from package_report import PackageReport, Timings
 
-try:
-    from StringIO import StringIO as BufferIO
-except ImportError:
-    from io import BytesIO as BufferIO
 
-try:
-    import zlib
+# Write-through wrapper that hashes the archive while it's produced: whole-object md5
+# plus one md5 per multipart chunk, so no second pass over the file is needed
+class ChecksumWriter:
+    def __init__(self, fileobj, chunk_size, timings=None):
+        self.fileobj = fileobj
+        self.chunk_size = chunk_size
+        self.timings = timings
+        self.size = 0
+        self.md5 = hashlib.new("md5")
+        self.part = hashlib.new("md5")
+        self.part_size = 0
+        self.part_md5s = []
 
-    compression = zipfile.ZIP_DEFLATED
-except ImportError:
-    compression = zipfile.ZIP_STORED
+    def write(self, data):
+        self.fileobj.write(data)
+        start = time.perf_counter()
+        self.md5.update(data)
+        self.size += len(data)
+
+        data = memoryview(data)
+        while data:
+            piece = data[:self.chunk_size - self.part_size]
+            self.part.update(piece)
+            self.part_size += len(piece)
+            data = data[len(piece):]
+
+            if self.part_size == self.chunk_size:
+                self.part_md5s.append(self.part.hexdigest())
+                self.part = hashlib.new("md5")
+                self.part_size = 0
+
+        if self.timings:
+            self.timings.add_time("checksum", time.perf_counter() - start)
+
+    def meta(self):
+        part_md5s = self.part_md5s + ([self.part.hexdigest()] if self.part_size else [])
+
+        return {
+            "size": self.size,
+            "md5": self.md5.hexdigest(),
+            "part_md5s": part_md5s,
+            "chunk_size": self.chunk_size,
+        }
 
 
 class S3Package(Hook):
     NAME = "s3_package"
     TARGET = "dist"
+    LAYER = "layer"
     DELIMITER = "^^"
 
+    SPOOL_SIZE = 16 * 1024 * 1024
+    MULTIPART_THRESHOLD = 16 * 1024 * 1024
+    MULTIPART_CHUNKSIZE = 8 * 1024 * 1024
+    MULTIPART_CONCURRENCY = 8
+
+    LEVEL = DEFAULT_LEVEL
+    WORKERS = DEFAULT_WORKERS
+    SLIM = 1
+    SOURCELESS = 0
+    # interpreter matching the functions' runtime, .pyc files are specific to a Python version;
+    # functions of the stack's LambdaFunctionNames use their Runtime instead
+    PYTHON = "python3.6"
+
+    # where Lambda extracts function code and layers, used as the source path in tracebacks
+    CODE_DIR = "/var/task"
+    LAYER_DIR = "/opt"
+    # where Python imports from in each of them, prune rules are relative to it
+    IMPORT_DIRS = {CODE_DIR: "", LAYER_DIR: "python"}
+
+    # options accepted after a second delimiter, e.g. src/fn^^bucket/key^^level=9,workers=4
+    OPTIONS = {
+        "level": ("LEVEL", int),
+        "workers": ("WORKERS", int),
+        "slim": ("SLIM", int),
+        "sourceless": ("SOURCELESS", int),
+        "python": ("PYTHON", str),
+    }
+    # inclusive bounds of the numeric options, None is unbounded: zlib levels, and at least one thread
+    OPTION_RANGES = {
+        "level": (-1, 9),
+        "workers": (1, None),
+    }
+
+    LAYER_LOCKS = {}
+    LAYER_LOCKS_LOCK = threading.Lock()
+
     def __init__(self, *args, **kwargs):
         super(S3Package, self).__init__(*args, **kwargs)
+        self.explicit_options = set()
 
     def run(self):
-        if self.DELIMITER in self.argument:
-            fn_root_dir, s3_object = self.argument.split(self.DELIMITER, 1)
+        fn_root_dir, s3_object = self.parse_options(self.argument)
+
+        if s3_object:
             s3_bucket, s3_key = s3_object.split("/", 1)
             self.logger.debug(
                 "[{}] S3 bucket/key parsed from the argument".format(self.NAME)
             )
         elif "sceptre_user_data" in self.stack_config:
             code = self.stack_config.get("sceptre_user_data").get("Code", {})
-            fn_root_dir, s3_bucket, s3_key = [
-                self.argument,
+            s3_bucket, s3_key = [
                 code.get("S3Bucket"),
                 code.get("S3Key"),
             ]
@@ -63,68 +136,325 @@ class S3Package(Hook):
             s3_key = s3_key.resolve()
             self.logger.debug("[{}] resolved S3 key value to {}".format(self.NAME, s3_key))
 
+        timings = Timings(fn_root_dir)
+
+        try:
+            self.package(fn_root_dir, s3_bucket, s3_key, timings=timings)
+        finally:
+            self.report([timings])
+
+    def report(self, timings):
+        for t in timings:
+            self.logger.info("[{}] {}".format(self.NAME, t.summary()))
+
+        PackageReport.from_environment().write(timings)
+
+    def parse_options(self, argument):
+        target, s3_object, options = (argument.split(self.DELIMITER, 2) + ["", ""])[:3]
+        self.explicit_options = set()
+
+        for option in filter(None, options.split(",")):
+            name, _, value = [part.strip() for part in option.partition("=")]
+
+            if name not in self.OPTIONS:
+                raise Exception("Unknown {} option '{}'".format(self.NAME, name))
+
+            attribute, cast = self.OPTIONS[name]
+
+            try:
+                parsed = cast(value)
+            except ValueError:
+                raise Exception("{} option '{}' must be an {}, got '{}'".format(self.NAME, name, cast.__name__, value))
+
+            low, high = self.OPTION_RANGES.get(name, (None, None))
+
+            if (low is not None and parsed < low) or (high is not None and parsed > high):
+                raise Exception("{} option '{}' must be {}, got {}".format(
+                    self.NAME, name, "at least {}".format(low) if high is None else "{} to {}".format(low, high), parsed
+                ))
+
+            setattr(self, attribute, parsed)
+            self.explicit_options.add(name)
+            self.logger.debug("[{}] option {} set to {}".format(self.NAME, attribute, value))
+
+        return target, s3_object
+
+    def python(self, fn_root_dir):
+        # the function's Runtime from the stack's sceptre_user_data, the one the template gives it
+        # and keys its layer on; the python option only picks the interpreter for that version
+        runtime = function_runtime(self.stack_config.get("sceptre_user_data") or {}, fn_root_dir)
+
+        if runtime is None:
+            return self.PYTHON
+
+        if "python" not in self.explicit_options:
+            return runtime
+
+        if python_tag(self.PYTHON) != python_tag(runtime):
+            raise Exception(
+                "{} runs on {}, but the {} python option is {}: drop the option, or set it to a {} "
+                "interpreter".format(fn_root_dir, runtime, self.NAME, self.PYTHON, runtime)
+            )
+
+        return self.PYTHON
+
+    def manifest(self, cache, fn_root_dir):
+        # packaging options change the archive bytes, so they are part of the cache key
+        return cache.manifest(fn_root_dir, salt="level={},slim={},sourceless={},python={}".format(
+            self.LEVEL, self.SLIM, self.SOURCELESS, self.python(fn_root_dir)
+        ))
+
+    def package(self, fn_root_dir, s3_bucket, s3_key, made=False, timings=None):
+        timings = timings or Timings(fn_root_dir)
+        python = self.python(fn_root_dir)
+
+        try:
+            layer_timings = Timings(os.path.join(fn_root_dir, self.LAYER))
+            layer = self.package_layer(fn_root_dir, s3_bucket, s3_key, python, layer_timings)
+
+            if layer:
+                layer_timings.finish()
+                layer_report = dict(layer_timings.to_dict(), key=layer["key"])
+                timings.add_time("layer", layer_report["total"])
+                timings.set(layer=layer_report)
+
+            result = self.package_code(fn_root_dir, s3_bucket, s3_key, python, made, timings)
+            result["layer"] = layer
+        finally:
+            timings.finish()
+
+        return result
+
+    def package_layer(self, fn_root_dir, s3_bucket, s3_key, python, timings):
+        # built for the runtime's Python version, like the wheels installed into it
+        layer = layer_id(fn_root_dir, python)
+
+        if layer is None:
+            return None
+
+        key = layer_key(s3_key, layer)
+
+        # functions sharing a requirement set share the layer, build it once per process
+        with self.LAYER_LOCKS_LOCK:
+            lock = self.LAYER_LOCKS.setdefault((s3_bucket, key), threading.Lock())
+
+        with lock:
+            try:
+                with timings.span("head_object"):
+                    self.connection_manager.call(
+                        service="s3",
+                        command="head_object",
+                        kwargs={"Bucket": s3_bucket, "Key": key},
+                    )
+
+                self.logger.info(
+                    "[{}] skip layer for {} - s3://{}/{} already published".format(
+                        self.NAME, fn_root_dir, s3_bucket, key
+                    )
+                )
+
+                timings.set(status="skipped")
+                return {"key": key, "upload": "skipped"}
+            except ClientError as e:
+                if e.response["Error"]["Code"] not in ["404", "NoSuchKey"]:
+                    raise e
+
+            # make only installs layer/ when it's missing, and the one there may be for another Python
+            fn_layer_dir = os.path.join(fn_root_dir, self.LAYER)
+            rmtree(fn_layer_dir, ignore_errors=True)
+            self.make(fn_root_dir, timings, "{} LAYER_PYTHON={}".format(self.LAYER, shlex.quote(python)))
+
+            cache = BuildCache.from_environment()
+
+            with tempfile.SpooledTemporaryFile(max_size=self.SPOOL_SIZE) as buffer:
+                output = ChecksumWriter(buffer, self.MULTIPART_CHUNKSIZE, timings)
+                index = self.build(fn_layer_dir, output, cache.previous(fn_layer_dir), timings, self.LAYER_DIR, python)
+                meta = self.archive_meta(output, index, timings)
+
+                with timings.span("cache"):
+                    cache.remember(fn_layer_dir, buffer, index)
+
+                status, version = self.upload(buffer, meta, fn_layer_dir, s3_bucket, key, timings)
+
+            return {"key": key, "upload": status, "version": version}
+
+    def package_code(self, fn_root_dir, s3_bucket, s3_key, python, made, timings):
         fn_dist_dir = os.path.join(fn_root_dir, self.TARGET)
 
-        command = 'make -C {}'.format(fn_root_dir)
+        with timings.span("cache"):
+            cache = BuildCache.from_environment()
+            manifest = self.manifest(cache, fn_root_dir)
+            cached_archive, meta = self.cache_lookup(cache, manifest)
+
+        if cached_archive:
+            self.logger.info(
+                "[{}] build cache hit for {} ({}), skip making dependencies".format(
+                    self.NAME, fn_root_dir, manifest[:12]
+                )
+            )
+
+            if made:
+                rmtree(fn_dist_dir)
+
+            timings.set(
+                build="cached", files=meta.get("files"), bytes_in=meta.get("bytes_in"), bytes_out=meta["size"]
+            )
+
+            with open(cached_archive, "rb") as buffer:
+                status, version = self.upload(buffer, meta, fn_dist_dir, s3_bucket, s3_key, timings)
+
+            return {"build": "cached", "upload": status, "version": version, "size": meta["size"]}
+
+        if not made:
+            self.make(fn_root_dir, timings)
+
+        # zip is spooled to disk past SPOOL_SIZE, so memory stays flat for big bundles
+        with tempfile.SpooledTemporaryFile(max_size=self.SPOOL_SIZE) as buffer:
+            output = ChecksumWriter(buffer, self.MULTIPART_CHUNKSIZE, timings)
+            index = self.build(fn_dist_dir, output, cache.previous(fn_root_dir), timings, self.CODE_DIR, python)
+            meta = self.archive_meta(output, index, timings)
+            timings.set(build="built")
+
+            with timings.span("cache"):
+                cache.put(manifest, buffer, meta)
+                cache.remember(fn_root_dir, buffer, index)
+
+            status, version = self.upload(buffer, meta, fn_dist_dir, s3_bucket, s3_key, timings)
+
+        return {"build": "built", "upload": status, "version": version, "size": meta["size"]}
+
+    def cache_lookup(self, cache, manifest):
+        cached_archive, meta = cache.get(manifest)
+
+        if cached_archive and meta.get("chunk_size") == self.MULTIPART_CHUNKSIZE:
+            return cached_archive, meta
+
+        return None, None
+
+    def archive_meta(self, output, index, timings):
+        meta = output.meta()
+        meta.update(
+            files=len(index["entries"]),
+            bytes_in=sum(entry["size"] for entry in index["entries"].values()),
+        )
+
+        timings.set(files=meta["files"], bytes_in=meta["bytes_in"], bytes_out=meta["size"])
+
+        return meta
+
+    def make(self, fn_root_dir, timings, target=""):
+        command = 'make -C {} {}'.format(fn_root_dir, target).strip()
 
         self.logger.info(
             "Making dependencies with '{}' command, output hidden.".format(command)
         )
 
-        p = subprocess.Popen([command], shell = True, stdout = DEVNULL, stderr = DEVNULL)
-        p.wait()
+        with timings.span("make"):
+            p = subprocess.Popen([command], shell = True, stdout = subprocess.PIPE, stderr = subprocess.STDOUT)
+            output, _ = p.communicate()
 
         if p.returncode != 0:
-            raise Exception("Failed to make dependencies, debug command manually.")
+            raise Exception(
+                "Failed to make dependencies with '{}':\n{}".format(
+                    command, output.decode("utf-8", "replace")
+                )
+            )
+
+    def slim(self, fn_dist_dir, runtime_dir, python, timings):
+        rules = load_rules(os.path.dirname(fn_dist_dir))
+        import_dir = os.path.normpath(os.path.join(fn_dist_dir, self.IMPORT_DIRS[runtime_dir]))
+
+        with timings.span("prune"):
+            removed = prune(import_dir, rules) if os.path.isdir(import_dir) else 0
 
         self.logger.debug(
-            "[{}] reading ALL files from {}/ directory".format(self.NAME, fn_dist_dir)
+            "[{}] pruned {} paths from {}/ (see {})".format(self.NAME, removed, import_dir, RULES_FILE)
         )
 
-        files = sorted(
-            [
-                os.path.join(root[len(fn_dist_dir) + 1 :], file)
-                for root, _, files in os.walk(fn_dist_dir)
-                for file in files
-            ]
+        if not runnable(python):
+            if self.SOURCELESS:
+                raise Exception("{} can't be run, it's required to package {} without sources".format(
+                    python, fn_dist_dir
+                ))
+
+            self.logger.warning(
+                "[{}] {} can't be run, shipping {} without precompiled bytecode".format(
+                    self.NAME, python, fn_dist_dir
+                )
+            )
+            timings.set(pruned=removed)
+            return
+
+        with timings.span("precompile"):
+            compiled = precompile(fn_dist_dir, python, runtime_dir, self.SOURCELESS)
+
+        timings.set(pruned=removed, compiled=compiled)
+
+    def build(self, fn_dist_dir, output, previous, timings, runtime_dir, python):
+        # make output is slimmed in place: dead weight pruned, sources compiled ahead of the cold start
+        if self.SLIM:
+            self.slim(fn_dist_dir, runtime_dir, python, timings)
+
+        self.logger.debug(
+            "[{}] reading ALL files from {}/ directory".format(self.NAME, fn_dist_dir)
         )
 
-        buffer = BufferIO()
+        with timings.span("walk"):
+            files = sorted(
+                [
+                    os.path.join(root[len(fn_dist_dir) + 1 :], file)
+                    for root, _, files in os.walk(fn_dist_dir)
+                    for file in files
+                ]
+            )
 
-        # static timestamp to keep same ZIP checksum on same files
-        static_ts = int(datetime(2018, 1, 1).strftime("%s"))
+        # unchanged entries are copied compressed from the previous archive of this function
+        with timings.span("archive"), \
+                PreviousArchive(*previous, level=self.LEVEL) as previous_archive, \
+                ArchiveWriter(output, self.LEVEL, previous_archive, self.WORKERS) as archive:
+            archive.add_files((os.path.join(fn_dist_dir, file), file) for file in files)
 
-        with zipfile.ZipFile(buffer, mode="w", compression=compression) as f:
-            for file in files:
-                real_file = os.path.join(fn_dist_dir, file)
-                self.logger.debug("[{}] zipping file {}".format(self.NAME, real_file))
-                os.utime(real_file, (static_ts, static_ts))
-                f.write(real_file, arcname=file)
+        timings.set(reused_entries=archive.reused)
+
+        self.logger.debug(
+            "[{}] reused {}/{} compressed entries from previous archive".format(
+                self.NAME, archive.reused, len(files)
+            )
+        )
 
         rmtree(fn_dist_dir)
 
-        buffer.seek(0)
-        content = buffer.read()
+        return archive.index()
 
-        md5 = hashlib.new("md5")
-        md5.update(content)
+    def upload(self, buffer, meta, fn_dist_dir, s3_bucket, s3_key, timings):
+        etag = self.etag(meta)
+        known = registry().get(s3_bucket, s3_key)
 
         try:
-            self.connection_manager.call(
-                service="s3",
-                command="head_object",
-                kwargs={
-                    "Bucket": s3_bucket,
-                    "Key": s3_key,
-                    "IfMatch": '"{}"'.format(md5.hexdigest()),
-                },
-            )
+            # an ETag already observed in this run (or a fresh persisted one) saves the HEAD request
+            if known and known["etag"] == etag:
+                result = {"VersionId": known["version"]}
+            else:
+                with timings.span("head_object"):
+                    result = self.connection_manager.call(
+                        service="s3",
+                        command="head_object",
+                        kwargs={
+                            "Bucket": s3_bucket,
+                            "Key": s3_key,
+                            "IfMatch": '"{}"'.format(etag),
+                        },
+                    )
+                registry().record(s3_bucket, s3_key, result.get("VersionId"), result.get("ETag"))
 
             self.logger.info(
                 "[{}] skip packaging {} - no changes detected".format(
                     self.NAME, fn_dist_dir
                 )
             )
+
+            timings.set(status="skipped", version=result.get("VersionId"))
+            return "skipped", result.get("VersionId")
         except ClientError as e:
             if e.response["Error"]["Code"] not in ["404", "412"]:
                 raise e
@@ -135,19 +465,100 @@ class S3Package(Hook):
                 )
             )
 
+            with timings.span("upload"):
+                if meta["size"] > self.MULTIPART_THRESHOLD:
+                    result = self.upload_multipart(buffer, s3_bucket, s3_key, meta["part_md5s"])
+                else:
+                    buffer.seek(0)
+                    result = self.connection_manager.call(
+                        service="s3",
+                        command="put_object",
+                        kwargs={
+                            "Bucket": s3_bucket,
+                            "Key": s3_key,
+                            "Body": buffer,
+                            "ContentMD5": self.b64md5(meta["md5"]),
+                        },
+                    )
+
+            registry().record(s3_bucket, s3_key, result.get("VersionId"), result.get("ETag"))
+
+            self.logger.debug(
+                "[{}] object s3://{}/{} new version: {}".format(
+                    self.NAME, s3_bucket, s3_key, result.get("VersionId")
+                )
+            )
+
+            timings.set(status="uploaded", version=result.get("VersionId"))
+            return "uploaded", result.get("VersionId")
+
+    def etag(self, meta):
+        if meta["size"] <= self.MULTIPART_THRESHOLD:
+            return meta["md5"]
+
+        # S3 multipart ETag: md5 of the concatenated part digests, suffixed with the part count
+        return "{}-{}".format(
+            hashlib.new("md5", b"".join(bytes.fromhex(p) for p in meta["part_md5s"])).hexdigest(),
+            len(meta["part_md5s"]),
+        )
+
+    @staticmethod
+    def b64md5(hexdigest):
+        return b64encode(bytes.fromhex(hexdigest)).strip().decode("utf-8")
+
+    def upload_multipart(self, fileobj, s3_bucket, s3_key, part_md5s):
+        upload_id = self.connection_manager.call(
+            service="s3",
+            command="create_multipart_upload",
+            kwargs={"Bucket": s3_bucket, "Key": s3_key},
+        )["UploadId"]
+
+        lock = threading.Lock()
+
+        def upload_part(number):
+            with lock:
+                fileobj.seek((number - 1) * self.MULTIPART_CHUNKSIZE)
+                body = fileobj.read(self.MULTIPART_CHUNKSIZE)
+
+            self.logger.debug(
+                "[{}] uploading part {}/{} of s3://{}/{}".format(
+                    self.NAME, number, len(part_md5s), s3_bucket, s3_key
+                )
+            )
+
             result = self.connection_manager.call(
                 service="s3",
-                command="put_object",
+                command="upload_part",
                 kwargs={
                     "Bucket": s3_bucket,
                     "Key": s3_key,
-                    "Body": content,
-                    "ContentMD5": b64encode(md5.digest()).strip().decode("utf-8"),
+                    "UploadId": upload_id,
+                    "PartNumber": number,
+                    "Body": body,
+                    "ContentMD5": self.b64md5(part_md5s[number - 1]),
                 },
             )
 
-            self.logger.debug(
-                "[{}] object s3://{}/{} new version: {}".format(
-                    self.NAME, s3_bucket, s3_key, result.get("VersionId")
-                )
+            return {"ETag": result["ETag"], "PartNumber": number}
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.MULTIPART_CONCURRENCY) as executor:
+                parts = list(executor.map(upload_part, range(1, len(part_md5s) + 1)))
+        except Exception:
+            self.connection_manager.call(
+                service="s3",
+                command="abort_multipart_upload",
+                kwargs={"Bucket": s3_bucket, "Key": s3_key, "UploadId": upload_id},
             )
+            raise
+
+        return self.connection_manager.call(
+            service="s3",
+            command="complete_multipart_upload",
+            kwargs={
+                "Bucket": s3_bucket,
+                "Key": s3_key,
+                "UploadId": upload_id,
+                "MultipartUpload": {"Parts": parts},
+            },
+        )
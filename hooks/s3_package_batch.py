@@ -0,0 +1,102 @@
+import glob, os
+from shutil import rmtree
+from concurrent.futures import ThreadPoolExecutor
+from build_cache import BuildCache
+from package_report import Timings
+from s3_package import S3Package
+
+
+class S3PackageBatch(S3Package):
+    NAME = "s3_package_batch"
+    SEPARATOR = ","
+    PLACEHOLDER = "{name}"
+
+    BUILD_WORKERS = os.cpu_count() or 1
+    UPLOAD_WORKERS = 4
+
+    def __init__(self, *args, **kwargs):
+        super(S3PackageBatch, self).__init__(*args, **kwargs)
+
+    def run(self):
+        patterns, s3_object = self.parse_options(self.argument)
+
+        if not s3_object:
+            raise Exception(
+                "S3 bucket/key template could not be parsed from the argument, "
+                "expected '<glob>[,<glob>...]{}<bucket>/<key>'".format(self.DELIMITER)
+            )
+
+        s3_bucket, s3_key = s3_object.split("/", 1)
+
+        if self.PLACEHOLDER not in s3_key:
+            s3_key = "{}/{}.zip".format(s3_key.rstrip("/"), self.PLACEHOLDER)
+
+        fn_root_dirs = self.function_roots(patterns)
+
+        if not fn_root_dirs:
+            raise Exception("No function directories with a Makefile match '{}'".format(patterns))
+
+        self.logger.info(
+            "[{}] packaging {} functions: {}".format(
+                self.NAME, len(fn_root_dirs), ", ".join(fn_root_dirs)
+            )
+        )
+
+        timings = {fn_root_dir: Timings(fn_root_dir) for fn_root_dir in fn_root_dirs}
+
+        try:
+            return self.package_all(fn_root_dirs, s3_bucket, s3_key, timings)
+        finally:
+            self.report([timings[fn_root_dir] for fn_root_dir in fn_root_dirs])
+
+    def package_all(self, fn_root_dirs, s3_bucket, s3_key, timings):
+        # make only what the build cache can't serve, every build is its own process
+        cache = BuildCache.from_environment()
+        pending = [
+            fn_root_dir for fn_root_dir in fn_root_dirs
+            if not self.cache_lookup(cache, self.manifest(cache, fn_root_dir))[0]
+        ]
+
+        with ThreadPoolExecutor(max_workers=self.BUILD_WORKERS) as executor:
+            builds = dict(zip(pending, executor.map(
+                lambda fn_root_dir: self.try_make(fn_root_dir, timings[fn_root_dir]), pending
+            )))
+
+        failures = {fn_root_dir: error for fn_root_dir, error in builds.items() if error}
+
+        if failures:
+            for fn_root_dir in builds:
+                rmtree(os.path.join(fn_root_dir, self.TARGET), ignore_errors=True)
+                timings[fn_root_dir].set(status="failed" if builds[fn_root_dir] else "aborted")
+
+            raise Exception("\n\n".join(
+                "[{}] {}".format(fn_root_dir, error)
+                for fn_root_dir, error in sorted(failures.items())
+            ))
+
+        def package(fn_root_dir):
+            key = s3_key.replace(self.PLACEHOLDER, os.path.basename(fn_root_dir))
+            return self.package(
+                fn_root_dir, s3_bucket, key, made=fn_root_dir in builds, timings=timings[fn_root_dir]
+            )
+
+        with ThreadPoolExecutor(max_workers=self.UPLOAD_WORKERS) as executor:
+            return dict(zip(fn_root_dirs, executor.map(package, fn_root_dirs)))
+
+    def function_roots(self, patterns):
+        fn_root_dirs = set()
+
+        for pattern in patterns.split(self.SEPARATOR):
+            for path in glob.glob(pattern.strip()):
+                if os.path.isfile(os.path.join(path, "Makefile")):
+                    fn_root_dirs.add(os.path.normpath(path))
+
+        return sorted(fn_root_dirs)
+
+    def try_make(self, fn_root_dir, timings):
+        try:
+            self.make(fn_root_dir, timings)
+        except Exception as e:
+            return str(e)
+
+        return None
@@ -0,0 +1,108 @@
+import json, os, tempfile, threading, time
+from concurrent.futures import ThreadPoolExecutor
+
+# botocore keeps up to 10 pooled connections per client, more workers would just queue on them
+BULK_WORKERS = 10
+
+
+# (bucket, key) -> VersionId/ETag observed during this run, shared by the s3_package hooks and the
+# s3_version resolver; optionally persisted with a TTL so consecutive sceptre invocations reuse it
+class ArtifactRegistry:
+    def __init__(self, path=None, ttl=0):
+        self.path = path
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = {}
+
+        self.load()
+
+    @classmethod
+    def from_environment(cls):
+        return cls(
+            os.environ.get("S3_ARTIFACT_REGISTRY", os.path.join(".cache", "s3_artifacts.json")),
+            int(os.environ.get("S3_ARTIFACT_REGISTRY_TTL", 0)),
+        )
+
+    def get(self, s3_bucket, s3_key):
+        with self.lock:
+            return self.entries.get("{}/{}".format(s3_bucket, s3_key))
+
+    def record(self, s3_bucket, s3_key, version_id, etag):
+        with self.lock:
+            self.entries["{}/{}".format(s3_bucket, s3_key)] = {
+                "version": version_id,
+                "etag": (etag or "").strip('"'),
+                "time": time.time(),
+            }
+            self.save()
+
+    def version(self, connection_manager, s3_bucket, s3_key):
+        entry = self.get(s3_bucket, s3_key)
+
+        if entry is None:
+            result = connection_manager.call(
+                service="s3",
+                command="head_object",
+                kwargs={"Bucket": s3_bucket, "Key": s3_key},
+            )
+            self.record(s3_bucket, s3_key, result.get("VersionId"), result.get("ETag"))
+            entry = self.get(s3_bucket, s3_key)
+
+        return entry["version"]
+
+    def versions(self, connection_manager, targets, workers=BULK_WORKERS):
+        missing = sorted({target for target in targets if self.get(*target) is None})
+
+        if missing:
+            with ThreadPoolExecutor(max_workers=min(workers, len(missing))) as executor:
+                list(executor.map(
+                    lambda target: self.version(connection_manager, *target), missing
+                ))
+
+        return {target: self.get(*target)["version"] for target in targets}
+
+    def load(self):
+        if not self.ttl or not self.path:
+            return
+
+        try:
+            with open(self.path) as f:
+                entries = json.load(f)
+        except (IOError, ValueError):
+            return
+
+        expiry = time.time() - self.ttl
+        self.entries = {
+            name: entry for name, entry in entries.items() if entry.get("time", 0) > expiry
+        }
+
+    def save(self):
+        if not self.ttl or not self.path:
+            return
+
+        directory = os.path.dirname(self.path) or "."
+        os.makedirs(directory, exist_ok=True)
+
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(self.entries, f)
+
+        os.replace(tmp_path, self.path)
+
+
+# sceptre re-executes plugin modules on every config read, keep the run-scoped registry across reloads
+try:
+    REGISTRY
+except NameError:
+    REGISTRY = None
+    REGISTRY_LOCK = threading.Lock()
+
+
+def registry():
+    global REGISTRY
+
+    with REGISTRY_LOCK:
+        if REGISTRY is None:
+            REGISTRY = ArtifactRegistry.from_environment()
+
+        return REGISTRY
@@ -1,3 +1,4 @@
+import artifact_registry
 from sceptre.resolvers import Resolver
 
 
@@ -8,6 +9,55 @@ class S3Version(Resolver):
         super(S3Version, self).__init__(*args, **kwargs)
 
     def resolve(self):
+        s3_bucket, s3_key = self.target()
+        registry = artifact_registry.registry()
+
+        # first unresolved s3_version of a stack HEADs every sibling's object concurrently,
+        # the rest are answered from the registry
+        if registry.get(s3_bucket, s3_key) is None:
+            targets = self.stack_targets()
+            self.logger.debug(
+                "[{}] resolving {} S3 object versions concurrently".format(self.NAME, len(targets))
+            )
+            registry.versions(self.connection_manager, targets)
+
+        version_id = registry.version(self.connection_manager, s3_bucket, s3_key)
+
+        self.logger.debug(
+            "[{}] object s3://{}/{} latest version: {}".format(
+                self.NAME, s3_bucket, s3_key, version_id
+            )
+        )
+
+        return version_id
+
+    def stack_targets(self):
+        targets = {self.target()}
+        stack_config = self.stack_config or {}
+
+        for value in self.resolvers([stack_config.get("parameters", {}), stack_config.get("sceptre_user_data", {})]):
+            # compared by NAME, sceptre may have reloaded this module since the resolver was built
+            if getattr(value, "NAME", None) == self.NAME:
+                try:
+                    targets.add(value.target())
+                except Exception:
+                    # a malformed sibling fails on its own resolve()
+                    pass
+
+        return sorted(targets)
+
+    def resolvers(self, value):
+        # parameters are flat, sceptre_user_data (e.g. LambdaObjectVersions) may nest resolvers
+        if isinstance(value, Resolver):
+            yield value
+        elif isinstance(value, dict):
+            for item in value.values():
+                yield from self.resolvers(item)
+        elif isinstance(value, list):
+            for item in value:
+                yield from self.resolvers(item)
+
+    def target(self):
         if self.argument:
             s3_bucket, s3_key = self.argument.split("/", 1)
             self.logger.debug(
@@ -26,18 +76,4 @@ class S3Version(Resolver):
                 "S3 bucket/key could not be parsed nor from the argument, neither from sceptre_user_data['Code']"
             )
 
-        result = self.connection_manager.call(
-            service="s3",
-            command="head_object",
-            kwargs={"Bucket": s3_bucket, "Key": s3_key},
-        )
-
-        version_id = result.get("VersionId")
-
-        self.logger.debug(
-            "[{}] object s3://{}/{} latest version: {}".format(
-                self.NAME, s3_bucket, s3_key, version_id
-            )
-        )
-
-        return version_id
+        return s3_bucket, s3_key
@@ -1,9 +1,14 @@
-import json
+import os
 
+import lambda_runtime
+
+DEFAULT_NAME = os.environ.get('DEFAULT_NAME', 'World')
+
+
+@lambda_runtime.handler()
 def handler(event, _context):
-    print(json.dumps(event))
-    event['queryStringParameters'] = event['queryStringParameters'] or {}
-    name = event['queryStringParameters'].get('name', '').upper() or 'World'
+    query = event.get('queryStringParameters') or {}
+    name = query.get('name', '').upper() or DEFAULT_NAME
 
     return {
         'statusCode': 200,
@@ -0,0 +1,69 @@
+import json
+
+import lambda_runtime
+
+
+class Context:
+    aws_request_id = 'request-1'
+
+
+def records(capsys):
+    out = capsys.readouterr().out
+    return [json.loads(line) for line in out.splitlines()]
+
+
+def echo(event, _context):
+    return event
+
+
+def test_cold_start_is_flagged_once(monkeypatch, capsys):
+    monkeypatch.setitem(lambda_runtime._state, 'cold_start', True)
+    handler = lambda_runtime.handler(sample_rate=0, metrics_rate=1)(echo)
+
+    handler({}, Context())
+    handler({}, Context())
+
+    assert [r['ColdStart'] for r in records(capsys)] == [True, False]
+
+
+def test_events_are_logged_when_sampled(monkeypatch, capsys):
+    monkeypatch.setattr(lambda_runtime, 'LOG_LEVEL',
+                        lambda_runtime.LEVELS['INFO'])
+
+    unsampled = lambda_runtime.handler(sample_rate=0, metrics_rate=0)(echo)
+    unsampled({'a': 1}, Context())
+    assert records(capsys) == []
+
+    sampled = lambda_runtime.handler(sample_rate=1, metrics_rate=0)(echo)
+    sampled({'a': 1}, Context())
+    assert records(capsys) == [{
+        'level': 'INFO', 'message': 'event',
+        'function': lambda_runtime.FUNCTION_NAME,
+        'request_id': 'request-1', 'event': {'a': 1},
+    }]
+
+
+def test_duration_metric_is_embedded_metric_format(capsys):
+    handler = lambda_runtime.handler(sample_rate=0, metrics_rate=1)(echo)
+    assert handler('event', Context()) == 'event'
+
+    [record] = records(capsys)
+    [directive] = record['_aws']['CloudWatchMetrics']
+
+    assert directive == {
+        'Namespace': lambda_runtime.METRICS_NAMESPACE,
+        'Dimensions': [['FunctionName']],
+        'Metrics': [{'Name': 'Duration', 'Unit': 'Milliseconds'}],
+    }
+    assert record['FunctionName'] == lambda_runtime.FUNCTION_NAME
+    assert record['RequestId'] == 'request-1'
+    assert record['SampleRate'] == 1
+    assert record['Duration'] >= 0
+
+
+def test_duration_metric_is_off_by_default(monkeypatch, capsys):
+    monkeypatch.setattr(lambda_runtime, 'METRICS_SAMPLE_RATE', 0)
+
+    lambda_runtime.handler(sample_rate=0)(echo)({}, Context())
+
+    assert records(capsys) == []
@@ -0,0 +1,106 @@
+import json
+import os
+import random
+import sys
+import time
+import traceback
+from functools import lru_cache, wraps
+
+LEVELS = {'DEBUG': 10, 'INFO': 20, 'WARNING': 30, 'ERROR': 40}
+
+# configuration is read once per container and reused by every warm invocation
+LOG_LEVEL = LEVELS.get(
+    os.environ.get('LOG_LEVEL', 'INFO').upper(), LEVELS['INFO'])
+EVENT_SAMPLE_RATE = float(os.environ.get('LOG_EVENT_SAMPLE_RATE', '0'))
+# fraction of invocations that emit a Duration metric, every one is a log line
+METRICS_SAMPLE_RATE = float(os.environ.get('METRICS_SAMPLE_RATE', '0'))
+METRICS_NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'ServerlessDemo')
+FUNCTION_NAME = os.environ.get('AWS_LAMBDA_FUNCTION_NAME', 'local')
+
+_state = {'cold_start': True}
+
+
+def enabled(level):
+    return LEVELS[level] >= LOG_LEVEL
+
+
+def write(record):
+    line = json.dumps(record, default=str, separators=(',', ':'))
+    sys.stdout.write(line + '\n')
+
+
+def log(level, message, **fields):
+    # the level check comes first, so disabled records cost neither
+    # serialization nor I/O
+    if enabled(level):
+        write(dict(fields, level=level, message=message,
+                   function=FUNCTION_NAME))
+
+
+def resource(factory):
+    # zero-argument factory (clients, config) evaluated on first use and kept
+    # for the container lifetime
+    return lru_cache(maxsize=None)(factory)
+
+
+def metric(name, value, unit='Milliseconds', **properties):
+    if not METRICS_NAMESPACE:
+        return
+
+    # CloudWatch Embedded Metric Format, extracted from the log line without
+    # any API call
+    write(dict(properties, **{
+        '_aws': {
+            'Timestamp': int(time.time() * 1000),
+            'CloudWatchMetrics': [{
+                'Namespace': METRICS_NAMESPACE,
+                'Dimensions': [['FunctionName']],
+                'Metrics': [{'Name': name, 'Unit': unit}],
+            }],
+        },
+        'FunctionName': FUNCTION_NAME,
+        name: value,
+    }))
+
+
+def sampled(rate):
+    return rate >= 1 or (rate > 0 and random.random() < rate)
+
+
+def handler(sample_rate=None, metrics_rate=None):
+    rate = EVENT_SAMPLE_RATE if sample_rate is None else sample_rate
+    duration_rate = METRICS_SAMPLE_RATE if metrics_rate is None \
+        else metrics_rate
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(event, context):
+            cold_start, _state['cold_start'] = _state['cold_start'], False
+            request_id = getattr(context, 'aws_request_id', None)
+
+            # full events are only serialized at DEBUG level or for a sampled
+            # fraction of invocations
+            if enabled('DEBUG') or sampled(rate):
+                write({'level': 'INFO', 'message': 'event',
+                       'function': FUNCTION_NAME, 'request_id': request_id,
+                       'event': event})
+
+            start = time.perf_counter()
+
+            try:
+                return func(event, context)
+            except Exception:
+                log('ERROR', 'unhandled exception', request_id=request_id,
+                    error=traceback.format_exc())
+                raise
+            finally:
+                # the rate goes with the record, so counts can be scaled back
+                if sampled(duration_rate):
+                    duration = (time.perf_counter() - start) * 1000
+                    metric('Duration', round(duration, 3),
+                           ColdStart=cold_start, RequestId=request_id,
+                           SampleRate=duration_rate)
+
+        return wrapper
+
+    return decorator
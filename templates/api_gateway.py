@@ -1,7 +1,11 @@
 import os
+import sys
+import json
+import hashlib
 import yaml
 
-from troposphere import Template, Parameter, Ref, Output, GetAtt, Join
+import troposphere
+from troposphere import Template, Parameter, Ref, Output, GetAtt, Join, encode_to_dict
 from troposphere.awslambda import Function, Code, Version
 from troposphere.apigateway import Deployment, Stage, RestApi
 from troposphere.iam import Role, Policy
@@ -11,13 +15,43 @@ SWAGGER_TEMPLATE_PATH = "../src/swagger.cloudformation.yaml"
 MAPPING_TEMPLATE = '#set($allParams=$input.params()){"body-json":$input.json("$"),"params":{#foreach($type in $allParams.keySet())#set($params=$allParams.get($type)) "$type":{#foreach($paramName in $params.keySet())"$paramName":"$util.escapeJavaScript($params.get($paramName))"#if($foreach.hasNext),#end#end}#if($foreach.hasNext),#end#end},"stage-variables":{#foreach($key in $stageVariables.keySet())"$key":"$util.escapeJavaScript($stageVariables.get($key))"#if($foreach.hasNext),#end#end}}'
 CUSTOM_APIGW_DEPLOYMENT_PATH = "../custom_resources/apigw_deployment.py"
 
+# per-operation cache settings in the swagger file, e.g. `x-cache: {ttl: 300, keys: [name]}`
+CACHE_EXTENSION = "x-cache"
+CACHE_KEY_LOCATIONS = {"query": "querystring", "path": "path", "header": "header"}
+HTTP_METHODS = ["get", "put", "post", "delete", "options", "head", "patch"]
+
+sys.path.append(os.path.dirname(os.path.realpath(__file__)))
+import render_cache  # noqa: E402
+
+
+# Dedicated loader, so the CloudFormation tags aren't registered on PyYAML's global Loader;
+# libyaml's C parser is used when PyYAML was built with it
+class SwaggerLoader(getattr(yaml, "CSafeLoader", yaml.SafeLoader)):
+    pass
+
+
+SwaggerLoader.add_constructor('!Ref', lambda loader, node: Ref(loader.construct_scalar(node)))
+SwaggerLoader.add_constructor('!GetAtt', lambda loader, node: GetAtt(*loader.construct_scalar(node).split('.')))
+
 
 def sceptre_handler(sceptre_user_data=None):
     sceptre_user_data = sceptre_user_data or {}
+    script_path = os.path.dirname(os.path.realpath(__file__))
+
+    # every input of the rendered template, an unchanged set reuses the previous render
+    paths = [
+        os.path.realpath(__file__),
+        os.path.join(script_path, SWAGGER_TEMPLATE_PATH),
+        os.path.join(script_path, CUSTOM_APIGW_DEPLOYMENT_PATH),
+    ]
 
-    template = MainTemplate(sceptre_user_data.get('LambdaFunctionNames', []))
-    yaml = template.t.to_yaml()
-    return yaml
+    return render_cache.render(
+        "api_gateway", sceptre_user_data, paths,
+        lambda: MainTemplate(
+            sceptre_user_data.get('LambdaFunctionNames', []), sceptre_user_data.get('APIGWCache')
+        ).t.to_yaml(),
+        salt=troposphere.__version__,
+    )
 
 
 class CustomAPIGWDeployment(AWSCustomObject):
@@ -27,14 +61,17 @@ class CustomAPIGWDeployment(AWSCustomObject):
         'ServiceToken': (str, True),
         'RestApiId': (str, True),
         'StageName': (str, True),
+        'DefinitionHash': (str, False),
         'LambdaUris': ([str], True),
+        'StageSettings': ([dict], False),
     }
 
 
 class MainTemplate:
-    def __init__(self, lambda_names):
+    def __init__(self, lambda_names, cache=None):
         self.t = Template()
         self.lambda_uris = []
+        self.cache = cache or {}
 
         lambda_iam_policy_arn = self.t.add_parameter(Parameter(
             "LambdaIAMPolicyARN",
@@ -85,9 +122,12 @@ class MainTemplate:
             ],
         ))
 
+        swagger = self.get_swagger()
+        stage_settings = self.apply_cache(swagger)
+
         apigw = self.t.add_resource(RestApi(
             "APIGW",
-            Body=self.get_swagger()
+            Body=swagger
         ))
 
         custom_apigw_deployment_role = self.t.add_resource(Role(
@@ -123,6 +163,32 @@ class MainTemplate:
                                 ]),
                             ],
                         },
+                        {
+                            "Effect": "Allow",
+                            "Action": ["apigateway:GET"],
+                            "Resource": [
+                                Join('', [
+                                    "arn:aws:apigateway:",
+                                    Ref('AWS::Region'),
+                                    "::/restapis/",
+                                    Ref(apigw),
+                                    "/*",
+                                ]),
+                            ],
+                        },
+                        {
+                            "Effect": "Allow",
+                            "Action": ["apigateway:PATCH"],
+                            "Resource": [
+                                Join('', [
+                                    "arn:aws:apigateway:",
+                                    Ref('AWS::Region'),
+                                    "::/restapis/",
+                                    Ref(apigw),
+                                    "/stages/*",
+                                ]),
+                            ],
+                        },
                     ]
                 })
             ],
@@ -144,7 +210,9 @@ class MainTemplate:
             ServiceToken=GetAtt(self.custom_apigw_deployment_lambda, "Arn"),
             RestApiId=Ref(apigw),
             StageName=Ref(apigw_stage_name),
-            LambdaUris=self.lambda_uris
+            DefinitionHash=self.definition_hash(swagger),
+            LambdaUris=self.lambda_uris,
+            StageSettings=[{"Path": path, "Value": value} for path, value in stage_settings]
         ))
 
         self.t.add_output(Output(
@@ -172,19 +240,63 @@ class MainTemplate:
         script_path = os.path.dirname(os.path.realpath(__file__))
         swagger_path = os.path.join(script_path, SWAGGER_TEMPLATE_PATH)
 
-        def ref_constructor(loader, node):
-            element = loader.construct_scalar(node)
-            return Ref(element)
+        with open(swagger_path) as f:
+            return yaml.load(f, Loader=SwaggerLoader)
 
-        def getatt_constructor(loader, node):
-            element, attribute = loader.construct_scalar(node).split('.')
-            return GetAtt(element, attribute)
+    # Turns the x-cache extension of every operation into cache key parameters on its integration,
+    # and returns the stage settings as (update_stage patch path, value): the cache cluster,
+    # stage-wide defaults (`*/*`), then per-operation TTLs (resource path slashes escaped as `~1`)
+    def apply_cache(self, swagger):
+        default_ttl = int(self.cache.get("DefaultTtl", 0))
+        stage_settings = [
+            ("/cacheClusterEnabled", "true"),
+            ("/cacheClusterSize", str(self.cache.get("ClusterSize", "0.5"))),
+            ("/*/*/caching/enabled", "true" if default_ttl else "false"),
+            ("/*/*/caching/ttlInSeconds", str(default_ttl)),
+            # who may bypass the cache with `Cache-Control: max-age=0`, and what the others get
+            ("/*/*/caching/requireAuthorizationForCacheControl",
+             "true" if self.cache.get("RequireAuthorization", True) else "false"),
+            ("/*/*/caching/unauthorizedCacheControlHeaderStrategy",
+             self.cache.get("UnauthorizedStrategy", "SUCCEED_WITH_RESPONSE_HEADER")),
+        ]
 
-        yaml.add_constructor('!Ref', ref_constructor)
-        yaml.add_constructor('!GetAtt', getatt_constructor)
+        for path, operations in sorted(swagger.get("paths", {}).items()):
+            for method in HTTP_METHODS:
+                operation = operations.get(method)
+                if not operation or CACHE_EXTENSION not in operation:
+                    continue
 
-        with open(swagger_path) as f:
-            return yaml.load(f.read())
+                settings = operation.pop(CACHE_EXTENSION)
+                parameters = {
+                    p["name"]: p["in"] for p in operations.get("parameters", []) + operation.get("parameters", [])
+                }
+
+                keys = []
+                for key in settings.get("keys", []):
+                    if parameters.get(key) not in CACHE_KEY_LOCATIONS:
+                        raise Exception(
+                            f"{CACHE_EXTENSION} key '{key}' of {method.upper()} {path} is not a declared "
+                            f"query, path or header parameter"
+                        )
+                    keys.append(f"method.request.{CACHE_KEY_LOCATIONS[parameters[key]]}.{key}")
+
+                if keys:
+                    operation["x-amazon-apigateway-integration"]["cacheKeyParameters"] = keys
+
+                ttl = int(settings.get("ttl", default_ttl))
+                prefix = f"/{path.replace('/', '~1')}/{method.upper()}"
+                stage_settings += [
+                    (f"{prefix}/caching/enabled", "true" if ttl else "false"),
+                    (f"{prefix}/caching/ttlInSeconds", str(ttl)),
+                ]
+
+        # without a cache cluster the method settings have no effect, disabling it is enough
+        return stage_settings if self.cache else [("/cacheClusterEnabled", "false")]
+
+    # Refs stay unresolved here, the custom resource combines this with the resolved LambdaUris
+    def definition_hash(self, swagger):
+        body = json.dumps(encode_to_dict(swagger), sort_keys=True)
+        return hashlib.sha256(body.encode("utf-8")).hexdigest()
 
     def get_custom_apigw_deployment_code(self):
         script_path = os.path.dirname(os.path.realpath(__file__))
@@ -1,36 +1,215 @@
+import hashlib
 import os
+import sys
 
-from troposphere import Template, Parameter, Ref, Output, GetAtt, Join
-from troposphere.awslambda import Function, Code
+import troposphere
+from troposphere import Template, Parameter, Ref, Output, GetAtt, Join, AWSProperty
+from troposphere import awslambda
+from troposphere.awslambda import Code, LayerVersion, Content
+from troposphere.validators import integer
 from troposphere.iam import Role, Policy
-from troposphere.cloudformation import AWSCustomObject
+from troposphere.cloudformation import AWSCustomObject, Stack
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), "../hooks"))
+sys.path.append(os.path.dirname(os.path.realpath(__file__)))
+import lambda_layer  # noqa: E402
+import render_cache  # noqa: E402
+from lambda_layer import layer_id, layer_key  # noqa: E402
 
 CUSTOM_LAMBDA_VERSION_PATH = "../custom_resources/lambda_version.py"
+LAMBDA_SOURCE_PATH = "../src"
+NESTED_KEY_PREFIX = "templates/lambda_functions"
+
+# functions per nested stack, each one takes a few parameters and an output; there are as many
+# shards as it takes to hold every function
+DEFAULT_SHARD_SIZE = 25
+
+# per-function settings, from sceptre_user_data.LambdaDefaults and LambdaSettings.<Name>;
+# API Gateway invokes every function through its alias, which holds provisioned concurrency
+DEFAULT_FUNCTION_SETTINGS = {
+    "FunctionName": None,
+    "Runtime": lambda_layer.DEFAULT_RUNTIME,
+    "MemorySize": 128,
+    "Timeout": 3,
+    "Architecture": None,
+    "ReservedConcurrentExecutions": None,
+    "ProvisionedConcurrentExecutions": None,
+}
+ALIAS_NAME = "live"
 
 
 def sceptre_handler(sceptre_user_data=None):
     sceptre_user_data = sceptre_user_data or {}
+    lambda_names = sceptre_user_data.get('LambdaFunctionNames', [])
+    script_path = os.path.dirname(os.path.realpath(__file__))
+
+    # every input of the rendered template, layers depend on each function's requirements.txt
+    paths = [
+        os.path.realpath(__file__),
+        os.path.realpath(lambda_layer.__file__),
+        os.path.join(script_path, CUSTOM_LAMBDA_VERSION_PATH),
+    ] + [
+        os.path.join(script_path, LAMBDA_SOURCE_PATH, name.lower(), lambda_layer.REQUIREMENTS)
+        for name in lambda_names
+    ]
+
+    return render_cache.render(
+        "lambda_functions", sceptre_user_data, paths,
+        lambda: MainTemplate(sceptre_user_data).t.to_yaml(),
+        salt=troposphere.__version__,
+    )
+
+
+# Shard template bodies by S3 key, uploaded by the s3_nested_templates hook before the stack is launched
+def nested_templates(sceptre_user_data=None):
+    sceptre_user_data = sceptre_user_data or {}
+
+    settings = function_settings(sceptre_user_data)
+    keys = function_keys(sceptre_user_data)
+
+    return {
+        shard.key: shard.body
+        for _, names in assign_shards(sceptre_user_data)
+        for shard in [ShardTemplate(names, settings, keys)]
+    }
+
+
+# Placement is recorded in sceptre_user_data.LambdaShards (shard index: [names]), so a function
+# only moves when its entry is edited. Functions without an entry fill the lowest-numbered shard
+# with room, then new shards: capacity grows with LambdaShardSize, and the placement of unrecorded
+# functions can change as others are added or removed, so record them
+def assign_shards(sceptre_user_data):
+    lambda_names = sorted(set(sceptre_user_data.get('LambdaFunctionNames', [])))
+    size = int(sceptre_user_data.get('LambdaShardSize', DEFAULT_SHARD_SIZE))
+
+    shards = {}
+    assigned = {}
+    for index, names in sorted((sceptre_user_data.get('LambdaShards') or {}).items()):
+        for name in names or []:
+            if name not in lambda_names:
+                raise Exception(f"LambdaShards puts {name} in shard {index}, but it isn't in LambdaFunctionNames")
+            if name in assigned:
+                raise Exception(f"LambdaShards puts {name} in both shard {assigned[name]} and shard {index}")
+
+            assigned[name] = int(index)
+            shards.setdefault(int(index), []).append(name)
+
+    for name in lambda_names:
+        if name not in assigned:
+            index = 0
+            while len(shards.get(index, [])) >= size:
+                index += 1
+            shards.setdefault(index, []).append(name)
+
+    for index, names in shards.items():
+        if len(names) > size:
+            raise Exception(
+                f"Lambda shard {index} has {len(names)} functions, more than LambdaShardSize={size}: "
+                f"move some to another shard in LambdaShards, or raise LambdaShardSize"
+            )
+
+    return sorted((index, sorted(names)) for index, names in shards.items())
+
+
+def function_keys(sceptre_user_data):
+    lambda_names = sceptre_user_data.get('LambdaFunctionNames', [])
+    keys = sceptre_user_data.get('LambdaObjectKeys', {})
+
+    for name in set(keys) - set(lambda_names):
+        raise Exception(f"LambdaObjectKeys has a key for {name}, which isn't in LambdaFunctionNames")
+
+    missing = sorted(set(lambda_names) - set(keys))
+    if missing:
+        raise Exception(f"LambdaObjectKeys has no S3 key for {', '.join(missing)}")
+
+    return {name: keys[name] for name in lambda_names}
 
-    template = MainTemplate(sceptre_user_data.get('LambdaFunctionNames', []))
-    yaml = template.t.to_yaml()
-    return yaml
 
+def function_settings(sceptre_user_data):
+    lambda_names = sceptre_user_data.get('LambdaFunctionNames', [])
+    overrides = sceptre_user_data.get('LambdaSettings', {})
 
-class CustomLambdaVersion(AWSCustomObject):
-    resource_type = "Custom::LambdaVersion"
+    for name in set(overrides) - set(lambda_names):
+        raise Exception(f"LambdaSettings has settings for {name}, which isn't in LambdaFunctionNames")
+
+    settings = {}
+    for name in lambda_names:
+        settings[name] = dict(DEFAULT_FUNCTION_SETTINGS)
+
+        for source in [sceptre_user_data.get('LambdaDefaults', {}), overrides.get(name, {})]:
+            for key, value in source.items():
+                if key not in DEFAULT_FUNCTION_SETTINGS:
+                    raise Exception(f"Unknown Lambda setting {key} for {name}, expected one of "
+                                    f"{', '.join(sorted(DEFAULT_FUNCTION_SETTINGS))}")
+                settings[name][key] = value
+
+        reserved = settings[name]["ReservedConcurrentExecutions"]
+        provisioned = settings[name]["ProvisionedConcurrentExecutions"]
+        if reserved is not None and provisioned is not None and int(provisioned) > int(reserved):
+            raise Exception(f"{name}: ProvisionedConcurrentExecutions ({provisioned}) can't exceed "
+                            f"ReservedConcurrentExecutions ({reserved})")
+
+        settings[name]["FunctionName"] = settings[name]["FunctionName"] or name
+
+    physical_names = [settings[name]["FunctionName"] for name in lambda_names]
+    for physical_name in sorted({n for n in physical_names if physical_names.count(n) > 1}):
+        raise Exception(f"More than one function is named {physical_name}, check FunctionName in LambdaSettings")
+
+    return settings
+
+
+# requirement set and Python version, the same key s3_package publishes the layer under
+def function_layer(name, runtime):
+    script_path = os.path.dirname(os.path.realpath(__file__))
+    return layer_id(os.path.join(script_path, LAMBDA_SOURCE_PATH, name.lower()), runtime)
+
+
+# one layer per S3 object: s3_package publishes it next to each function's own key
+def layer_name(s3_key):
+    return f"Layer{hashlib.sha256(s3_key.encode('utf-8')).hexdigest()[:16]}"
+
+
+# Properties newer than the pinned troposphere
+class Function(awslambda.Function):
+    props = dict(awslambda.Function.props, Architectures=([str], False))
+
+
+class ProvisionedConcurrencyConfiguration(AWSProperty):
+    props = {
+        'ProvisionedConcurrentExecutions': (integer, True),
+    }
+
+
+class Alias(awslambda.Alias):
+    props = dict(awslambda.Alias.props, ProvisionedConcurrencyConfig=(ProvisionedConcurrencyConfiguration, False))
+
+
+# one resource per shard, publishing every function's version in a single invocation;
+# each item carries Name, FunctionName, S3ObjectVersion and Layers, so any change updates the batch
+class CustomLambdaVersions(AWSCustomObject):
+    resource_type = "Custom::LambdaVersions"
 
     props = {
         'ServiceToken': (str, True),
-        'FunctionName': (str, True),
-        'S3ObjectVersion': (str, True),
+        'Functions': ([dict], True),
     }
 
 
 class MainTemplate:
-    def __init__(self, lambda_names):
+    def __init__(self, sceptre_user_data):
         self.t = Template()
+        self.versions = sceptre_user_data.get('LambdaObjectVersions', {})
+        self.settings = function_settings(sceptre_user_data)
+        self.keys = function_keys(sceptre_user_data)
+
+        # a layer lists the runtimes of every function using it
+        self.layer_runtimes = {}
+        for name, settings in self.settings.items():
+            layer = function_layer(name, settings["Runtime"])
+            if layer:
+                self.layer_runtimes.setdefault(layer_key(self.keys[name], layer), set()).add(settings["Runtime"])
 
-        artifacts_bucket_name = self.t.add_parameter(Parameter(
+        self.artifacts_bucket_name = self.t.add_parameter(Parameter(
             "ArtifactsBucketName",
             Description="Name of the S3 bucket to store Lambda function artifacts",
             AllowedPattern="[a-z0-9][a-z0-9.-]{2,62}",
@@ -43,7 +222,7 @@ class MainTemplate:
             Type="String"
         ))
 
-        lambda_role = self.t.add_resource(Role(
+        self.lambda_role = self.t.add_resource(Role(
             "LambdaRole",
             AssumeRolePolicyDocument={
                 "Version": "2012-10-17",
@@ -82,7 +261,11 @@ class MainTemplate:
                     "Statement": [
                         {
                             "Effect": "Allow",
-                            "Action": ["lambda:PublishVersion"],
+                            "Action": [
+                                "lambda:PublishVersion",
+                                "lambda:GetFunctionConfiguration",
+                                "lambda:ListVersionsByFunction",
+                            ],
                             "Resource": "*",
                         },
                     ]
@@ -96,14 +279,15 @@ class MainTemplate:
             Handler="index.handler",
             Runtime="python3.6",
             Role=GetAtt(custom_lambda_version_role, "Arn"),
+            Timeout=300,
             Code=Code(
                 ZipFile=self.get_custom_lambda_version_code()
             )
         ))
 
-        for l in lambda_names:
-            self.add_lambda(l, artifacts_bucket_name, lambda_role)
-
+        # shards don't depend on each other, so CloudFormation creates and updates them in parallel
+        for index, names in assign_shards(sceptre_user_data):
+            self.add_shard(index, names)
 
     def get_custom_lambda_version_code(self):
         script_path = os.path.dirname(os.path.realpath(__file__))
@@ -112,7 +296,136 @@ class MainTemplate:
         with open(code_path) as f:
             return f.read()
 
-    def add_lambda(self, name, s3_bucket, role):
+    def add_layer(self, s3_key, layer):
+        name = layer_name(s3_key)
+
+        # one layer per requirement set and Python version, a new one is published only when either changes
+        if name not in self.t.resources:
+            self.t.add_resource(LayerVersion(
+                name,
+                Description=f"Dependencies {layer}",
+                CompatibleRuntimes=sorted(self.layer_runtimes[s3_key]),
+                Content=Content(
+                    S3Bucket=Ref(self.artifacts_bucket_name),
+                    S3Key=s3_key
+                )
+            ))
+
+        return Ref(name)
+
+    def object_version(self, name):
+        if name in self.versions:
+            return self.versions[name]
+
+        # fallback for stacks that still pass versions as parameters, one per function
+        return Ref(self.t.add_parameter(Parameter(
+            f"{name}ObjectVersionS3",
+            Description=f"S3 object version ID for lambda function: {name}",
+            Type="String"
+        )))
+
+    def add_shard(self, index, names):
+        shard = ShardTemplate(names, self.settings, self.keys)
+
+        parameters = {
+            "ArtifactsBucketName": Ref(self.artifacts_bucket_name),
+            "LambdaRoleArn": GetAtt(self.lambda_role, "Arn"),
+            "CustomLambdaVersionArn": GetAtt(self.custom_lambda_version_lambda, "Arn"),
+        }
+
+        for s3_key, layer in shard.layers:
+            parameters[layer_name(s3_key)] = self.add_layer(s3_key, layer)
+
+        for name in names:
+            parameters[f"{name}KeyS3"] = self.keys[name]
+            parameters[f"{name}ObjectVersionS3"] = self.object_version(name)
+
+        stack = self.t.add_resource(Stack(
+            f"LambdaShard{index}",
+            TemplateURL=Join('', [
+                'https://',
+                Ref(self.artifacts_bucket_name),
+                '.s3.',
+                Ref('AWS::Region'),
+                '.',
+                Ref('AWS::URLSuffix'),
+                f'/{shard.key}',
+            ]),
+            Parameters=parameters
+        ))
+
+        # same output names as before sharding, api_gateway consumes them with !stack_output
+        for name in names:
+            self.t.add_output(Output(
+                f"{name}LambdaURI",
+                Value=GetAtt(stack, f"Outputs.{name}LambdaURI"),
+                Description=f"{name}LambdaURI"
+            ))
+
+
+class ShardTemplate:
+    def __init__(self, lambda_names, settings, keys):
+        self.t = Template()
+        self.layers = []
+        self.settings = settings
+        self.keys = keys
+
+        self.artifacts_bucket_name = self.t.add_parameter(Parameter(
+            "ArtifactsBucketName",
+            Description="Name of the S3 bucket to store Lambda function artifacts",
+            Type="String"
+        ))
+
+        self.lambda_role_arn = self.t.add_parameter(Parameter(
+            "LambdaRoleArn",
+            Description="ARN of the execution role for Lambda functions",
+            Type="String"
+        ))
+
+        self.custom_lambda_version_arn = self.t.add_parameter(Parameter(
+            "CustomLambdaVersionArn",
+            Description="ARN of the Lambda function backing Custom::LambdaVersions",
+            Type="String"
+        ))
+
+        self.functions = []
+        for l in lambda_names:
+            self.add_lambda(l)
+
+        # layers are part of the published version, a layer change has to publish a new one
+        versions = self.t.add_resource(CustomLambdaVersions(
+            "LambdaVersions",
+            ServiceToken=Ref(self.custom_lambda_version_arn),
+            Functions=[spec for _, spec in self.functions],
+        ))
+
+        # the URI targets the alias, moving it to a new version doesn't change the API definition
+        for name, spec in self.functions:
+            alias = self.add_alias(name, spec["FunctionName"], GetAtt(versions, name))
+            self.add_lambda_uri(name, alias)
+
+        self.body = self.t.to_yaml()
+        self.key = f"{NESTED_KEY_PREFIX}/{hashlib.sha256(self.body.encode('utf-8')).hexdigest()}.yaml"
+
+    def add_layers(self, name):
+        layer = function_layer(name, self.settings[name]["Runtime"])
+
+        if layer is None:
+            return []
+
+        s3_key = layer_key(self.keys[name], layer)
+
+        if (s3_key, layer) not in self.layers:
+            self.layers.append((s3_key, layer))
+            self.t.add_parameter(Parameter(
+                layer_name(s3_key),
+                Description=f"ARN of the layer version for dependencies {layer}",
+                Type="String"
+            ))
+
+        return [Ref(layer_name(s3_key))]
+
+    def add_lambda(self, name):
         s3_key = self.t.add_parameter(Parameter(
             f"{name}KeyS3",
             Description=f"S3 key for lambda function: {name}",
@@ -125,37 +438,64 @@ class MainTemplate:
             Type="String"
         ))
 
+        layers = self.add_layers(name)
+        settings = self.settings[name]
+
+        # published versions snapshot the configuration, so it's part of the batch item too
+        configuration = {
+            "Runtime": settings["Runtime"],
+            "MemorySize": int(settings["MemorySize"]),
+            "Timeout": int(settings["Timeout"]),
+            **({"Architectures": [settings["Architecture"]]} if settings["Architecture"] else {}),
+        }
+
+        reserved = settings["ReservedConcurrentExecutions"]
+
+        # CloudFormation creates a function before deleting the one it replaces, so a function that
+        # moves to another stack (e.g. from a stack deployed before sharding) needs a new FunctionName
         function = self.t.add_resource(Function(
             f"{name}Lambda",
-            FunctionName=name,
+            FunctionName=settings["FunctionName"],
             Handler="index.handler",
-            Runtime="python3.6",
-            Role=GetAtt(role, "Arn"),
+            Role=Ref(self.lambda_role_arn),
             Code=Code(
-                S3Bucket=Ref(s3_bucket),
+                S3Bucket=Ref(self.artifacts_bucket_name),
                 S3Key=Ref(s3_key),
                 S3ObjectVersion=Ref(s3_version)
-            )
+            ),
+            **configuration,
+            **({"ReservedConcurrentExecutions": int(reserved)} if reserved is not None else {}),
+            **({"Layers": layers} if layers else {})
         ))
 
-        version = self.t.add_resource(CustomLambdaVersion(
-            f"{name}LambdaVersion",
-            ServiceToken=GetAtt(self.custom_lambda_version_lambda, "Arn"),
-            FunctionName=Ref(function),
-            S3ObjectVersion=Ref(s3_version)
+        self.functions.append((name, {
+            "Name": name,
+            "FunctionName": Ref(function),
+            "S3ObjectVersion": Ref(s3_version),
+            **configuration,
+            **({"Layers": layers} if layers else {})
+        }))
+
+    def add_alias(self, name, function, version):
+        provisioned = self.settings[name]["ProvisionedConcurrentExecutions"]
+
+        return self.t.add_resource(Alias(
+            f"{name}LambdaAlias",
+            Name=ALIAS_NAME,
+            FunctionName=function,
+            FunctionVersion=version,
+            **({"ProvisionedConcurrencyConfig": ProvisionedConcurrencyConfiguration(
+                ProvisionedConcurrentExecutions=int(provisioned)
+            )} if provisioned else {})
         ))
 
+    def add_lambda_uri(self, name, alias):
+        # Ref of an alias is its ARN, i.e. the function's ARN qualified with the alias name
         uri = Join('', [
             'arn:aws:apigateway:',
             Ref('AWS::Region'),
-            ':lambda:path/2015-03-31/functions/arn:aws:lambda:',
-            Ref('AWS::Region'),
-            ':',
-            Ref('AWS::AccountId'),
-            ':function:',
-            Ref(function),
-            ':',
-            GetAtt(version, "Version"),
+            ':lambda:path/2015-03-31/functions/',
+            Ref(alias),
             '/invocations',
         ])
 
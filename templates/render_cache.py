@@ -0,0 +1,81 @@
+import hashlib
+import json
+import os
+import tempfile
+
+# rendered templates kept per template name, older ones are removed
+KEEP = 8
+
+# sceptre re-executes template modules on every render, this one is imported once per process
+MEMORY = {}
+
+
+def cache_dir():
+    # an empty value disables the on-disk cache shared by consecutive sceptre commands
+    return os.environ.get("SCEPTRE_TEMPLATE_CACHE_DIR", os.path.join(".cache", "templates"))
+
+
+def fingerprint(sceptre_user_data, paths, salt=""):
+    digest = hashlib.sha256(salt.encode("utf-8"))
+    digest.update(json.dumps(sceptre_user_data, sort_keys=True, default=str).encode("utf-8"))
+
+    for path in paths:
+        digest.update(b"\0" + os.path.abspath(path).encode("utf-8") + b"\0")
+
+        try:
+            with open(path, "rb") as f:
+                digest.update(f.read())
+        except IOError:
+            digest.update(b"\0missing")
+
+    return digest.hexdigest()
+
+
+def render(name, sceptre_user_data, paths, build, salt=""):
+    key = f"{name}-{fingerprint(sceptre_user_data, paths, salt)}"
+
+    if key in MEMORY:
+        return MEMORY[key]
+
+    directory = cache_dir()
+    path = os.path.join(directory, f"{key}.yaml") if directory else None
+
+    if path:
+        try:
+            with open(path) as f:
+                MEMORY[key] = f.read()
+            os.utime(path)
+            return MEMORY[key]
+        except IOError:
+            pass
+
+    body = build()
+    MEMORY[key] = body
+
+    if path:
+        store(directory, name, path, body)
+
+    return body
+
+
+def store(directory, name, path, body):
+    os.makedirs(directory, exist_ok=True)
+
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    with os.fdopen(fd, "w") as f:
+        f.write(body)
+
+    os.replace(tmp_path, path)
+
+    entries = sorted(
+        (os.path.join(directory, entry) for entry in os.listdir(directory)
+         if entry.startswith(f"{name}-") and entry.endswith(".yaml")),
+        key=os.path.getmtime,
+        reverse=True,
+    )
+
+    for entry in entries[KEEP:]:
+        try:
+            os.remove(entry)
+        except OSError:
+            pass